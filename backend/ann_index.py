@@ -0,0 +1,248 @@
+import os
+import numpy as np
+
+# IVF-PQ 近似最近邻索引 (纯 NumPy 实现)
+#
+# - 粗聚类 (IVF): 用 k-means 把人脸库划分为 nlist 个簇，每个簇维护一个倒排列表 (行号列表)。
+#   检索时只扫描离查询最近的 nprobe 个簇，nprobe 越大召回越高、延迟越高。
+# - 乘积量化 (PQ): 把每个编码相对于簇中心的残差切成 m 段，每段量化为 1 字节，
+#   检索时用查表 (ADC) 近似计算距离，每个候选只需 m 次查表。
+# - 精排: 由调用方 (FaceIndex) 对近似距离最小的 rerank 个候选用原始 float32 编码重新计算精确距离。
+#
+# 行号与 FaceIndex 的矩阵行号一一对应，行的增删/移动由 FaceIndex 在持有其锁时调用。
+
+INDEX_FILE_VERSION = 1
+
+def _sq_dists(x, centroids, centroid_sq_norms=None):
+    """(Internal) x (n, d) 与 centroids (k, d) 之间的平方欧氏距离矩阵 (n, k)。"""
+    if centroid_sq_norms is None:
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    dists = np.einsum('ij,ij->i', x, x)[:, None] - 2.0 * (x @ centroids.T) + centroid_sq_norms[None, :]
+    np.maximum(dists, 0.0, out=dists)
+    return dists
+
+def _assign(x, centroids, chunk_size=65536):
+    """(Internal) 分块计算每个向量最近的中心，避免一次性生成过大的距离矩阵。"""
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(x.shape[0], dtype=np.int32)
+    for start in range(0, x.shape[0], chunk_size):
+        chunk = x[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmin(_sq_dists(chunk, centroids, centroid_sq_norms), axis=1)
+    return labels
+
+def kmeans(x, k, iterations=20, seed=0):
+    """简单的 Lloyd k-means，返回 (k, d) 的 float32 中心矩阵。空簇会被随机样本重新初始化。"""
+    x = np.asarray(x, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    if x.shape[0] < k:
+        raise ValueError(f"训练样本数 ({x.shape[0]}) 少于聚类数 ({k})")
+    centroids = x[rng.choice(x.shape[0], size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        empty = np.flatnonzero(~non_empty)
+        if empty.size:
+            centroids[empty] = x[rng.choice(x.shape[0], size=empty.size, replace=False)]
+    return centroids
+
+class IVFPQIndex:
+    """倒排文件 + 乘积量化的近似最近邻索引，只负责生成候选，精确距离由调用方计算。"""
+
+    def __init__(self, dim, nlist=None, m=8, nprobe=16, rerank=64, ksub=256):
+        if dim % m != 0:
+            raise ValueError(f"编码维度 {dim} 必须能被 PQ 分段数 m={m} 整除")
+        self.dim = dim
+        self.nlist = nlist # None 表示训练时根据样本规模自动选择
+        self.m = m
+        self.dsub = dim // m
+        self.ksub = ksub
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.centroids = None # (nlist, dim) 粗聚类中心
+        self.codebooks = None # (m, ksub, dsub) PQ 码本
+        self._codebook_sq_norms = None
+        self._lists = [] # 每个簇的行号列表
+        self._list_of_row = np.empty(0, dtype=np.int32)
+        self._pos_of_row = np.empty(0, dtype=np.int32) # 行在所属倒排列表中的位置，用于 O(1) 删除
+        self._codes = np.empty((0, m), dtype=np.uint8)
+
+    @property
+    def trained(self):
+        return self.centroids is not None and self.codebooks is not None
+
+    @staticmethod
+    def default_nlist(count):
+        """按经验取 4*sqrt(N) 个簇，并保证每个簇平均至少约 39 个样本。"""
+        return int(max(1, min(4 * np.sqrt(count), count // 39, 65536)))
+
+    def train(self, vectors, max_train_samples=100000, seed=0):
+        """用给定向量训练粗聚类中心和 PQ 码本。"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        if vectors.shape[0] > max_train_samples:
+            vectors = vectors[rng.choice(vectors.shape[0], size=max_train_samples, replace=False)]
+        nlist = self.nlist or self.default_nlist(vectors.shape[0])
+        if vectors.shape[0] < max(nlist, self.ksub):
+            raise ValueError(f"训练样本数 ({vectors.shape[0]}) 不足，至少需要 {max(nlist, self.ksub)} 个")
+
+        centroids = kmeans(vectors, nlist, seed=seed)
+        residuals = vectors - centroids[_assign(vectors, centroids)]
+        codebooks = np.empty((self.m, self.ksub, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            codebooks[j] = kmeans(sub, self.ksub, iterations=15, seed=seed + j + 1)
+
+        self.nlist = nlist
+        self._set_quantizers(centroids, codebooks)
+
+    def _set_quantizers(self, centroids, codebooks):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+        self._codebook_sq_norms = np.einsum('mkd,mkd->mk', self.codebooks, self.codebooks)
+        self.reset(0)
+
+    def reset(self, capacity):
+        """清空所有倒排列表 (保留训练好的量化器)。"""
+        self._lists = [[] for _ in range(self.nlist or 0)]
+        self._list_of_row = np.full(capacity, -1, dtype=np.int32)
+        self._pos_of_row = np.full(capacity, -1, dtype=np.int32)
+        self._codes = np.zeros((capacity, self.m), dtype=np.uint8)
+
+    def ensure_capacity(self, capacity):
+        if capacity <= self._list_of_row.shape[0]:
+            return
+        size = self._list_of_row.shape[0]
+        list_of_row = np.full(capacity, -1, dtype=np.int32)
+        list_of_row[:size] = self._list_of_row
+        pos_of_row = np.full(capacity, -1, dtype=np.int32)
+        pos_of_row[:size] = self._pos_of_row
+        codes = np.zeros((capacity, self.m), dtype=np.uint8)
+        codes[:size] = self._codes
+        self._list_of_row, self._pos_of_row, self._codes = list_of_row, pos_of_row, codes
+
+    def encode(self, vectors):
+        """计算向量所属的簇以及残差的 PQ 编码。返回 (list_ids, codes)。"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        list_ids = _assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[list_ids]
+        codes = np.empty((vectors.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            codes[:, j] = np.argmin(_sq_dists(sub, self.codebooks[j], self._codebook_sq_norms[j]), axis=1)
+        return list_ids, codes
+
+    def add_rows(self, rows, vectors=None, list_ids=None, codes=None):
+        """把若干行加入倒排列表。可以直接传入已计算好的 list_ids/codes (例如从索引文件加载)。"""
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        if rows.size == 0:
+            return
+        if list_ids is None or codes is None:
+            list_ids, codes = self.encode(vectors)
+        self.ensure_capacity(int(rows.max()) + 1)
+        self._codes[rows] = codes
+        for row, list_id in zip(rows.tolist(), np.asarray(list_ids).tolist()):
+            bucket = self._lists[list_id]
+            self._list_of_row[row] = list_id
+            self._pos_of_row[row] = len(bucket)
+            bucket.append(row)
+
+    def remove_row(self, row):
+        """从倒排列表中删除一行 (与列表末尾交换后弹出)。"""
+        list_id = self._list_of_row[row]
+        if list_id < 0:
+            return
+        bucket = self._lists[list_id]
+        pos = self._pos_of_row[row]
+        tail = bucket.pop()
+        if tail != row:
+            bucket[pos] = tail
+            self._pos_of_row[tail] = pos
+        self._list_of_row[row] = -1
+        self._pos_of_row[row] = -1
+
+    def move_row(self, src, dst):
+        """FaceIndex 把第 src 行移动到第 dst 行 (dst 此前已被删除) 时同步更新倒排列表。"""
+        list_id = self._list_of_row[src]
+        if list_id < 0:
+            return
+        pos = self._pos_of_row[src]
+        self._lists[list_id][pos] = dst
+        self._list_of_row[dst] = list_id
+        self._pos_of_row[dst] = pos
+        self._codes[dst] = self._codes[src]
+        self._list_of_row[src] = -1
+        self._pos_of_row[src] = -1
+
+    def search_candidates(self, query, shortlist):
+        """返回近似距离最小的至多 shortlist 个行号 (未排序)，供调用方精排。"""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        nprobe = min(self.nprobe, self.nlist)
+        coarse = _sq_dists(query[None, :], self.centroids)[0]
+        probes = np.argpartition(coarse, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        row_parts = []
+        dist_parts = []
+        sub_index = np.arange(self.m)[None, :]
+        for list_id in probes:
+            bucket = self._lists[list_id]
+            if not bucket:
+                continue
+            rows = np.fromiter(bucket, dtype=np.int64, count=len(bucket))
+            # ADC 查表: table[j, c] = ||残差第 j 段 - 码字 c||^2
+            residual = (query - self.centroids[list_id]).reshape(self.m, 1, self.dsub)
+            table = self._codebook_sq_norms - 2.0 * np.einsum('mod,mkd->mk', residual, self.codebooks) \
+                + np.einsum('mod,mod->m', residual, residual)[:, None]
+            row_parts.append(rows)
+            dist_parts.append(table[sub_index, self._codes[rows]].sum(axis=1))
+
+        if not row_parts:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate(row_parts)
+        approx = np.concatenate(dist_parts)
+        if rows.size > shortlist:
+            rows = rows[np.argpartition(approx, shortlist - 1)[:shortlist]]
+        return rows
+
+    def save(self, path, row_keys, size):
+        """持久化量化器以及每一行的簇号和 PQ 编码 (npz 格式，先写临时文件再原子替换)。
+
+        row_keys 为每一行的键 (用户ID或样本键)，加载时按键把编码对应回新的行号。
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                version=np.array(INDEX_FILE_VERSION),
+                dim=np.array(self.dim),
+                m=np.array(self.m),
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                user_ids=np.asarray(row_keys[:size], dtype=str), # 字段名沿用旧版本，内容为行键
+                list_ids=self._list_of_row[:size],
+                codes=self._codes[:size],
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """加载索引文件。返回 {行键: (list_id, codes)}，由调用方按当前行号重新放入倒排列表。"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != INDEX_FILE_VERSION:
+                raise ValueError(f"不支持的索引文件版本: {int(data['version'])}")
+            if int(data['dim']) != self.dim or int(data['m']) != self.m:
+                raise ValueError("索引文件的维度或 PQ 分段数与当前配置不一致")
+            centroids = data['centroids']
+            codebooks = data['codebooks']
+            persisted = {
+                user_id: (list_id, codes)
+                for user_id, list_id, codes in zip(data['user_ids'].tolist(), data['list_ids'], data['codes'])
+                if list_id >= 0
+            }
+        self.nlist = centroids.shape[0]
+        self._set_quantizers(centroids, codebooks)
+        return persisted
@@ -3,11 +3,20 @@ from models import db # 从 models.py 导入 db 对象
 import os
 
 # 应用工厂模式
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, static_folder='../uploads', static_url_path='/user_photos')
 
     # 从 config.py 加载配置
     app.config.from_pyfile('config.py') # 或者 app.config.from_object('config')
+    if test_config:
+        app.config.update(test_config) # 基准测试等场景覆盖配置 (例如使用临时 SQLite 数据库)
+
+    # SQLite (本地调试) 使用 SQLAlchemy 默认的连接池，连接池大小相关的参数只对 MySQL 等服务端数据库生效
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            key: value for key, value in app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).items()
+            if key not in ('pool_size', 'max_overflow', 'pool_timeout')
+        }
 
     # 初始化 SQLAlchemy
     db.init_app(app) # 将 db 对象与 Flask app 实例关联
@@ -18,6 +27,11 @@ def create_app():
         db.create_all()
         print("数据库表已检查/创建 (如果不存在)。")
 
+        # 构建进程内人脸库索引 (仅在启动时全量加载一次，之后增量维护)
+        import data_store
+        data_store.rebuild_gallery_index(aggregation=app.config.get('FACE_SAMPLE_AGGREGATION', 'min'))
+        data_store.setup_gallery_ann(app.config) # 按配置启用近似最近邻后端 (默认暴力检索)
+
     # 确保 UPLOAD_FOLDER 配置可用
     upload_folder_name = app.config.get('UPLOAD_FOLDER', 'uploads') # 从配置获取，默认为 'uploads'
     
@@ -25,21 +39,73 @@ def create_app():
     from flask import send_from_directory # 需要导入
     import os # 需要导入
 
-    @app.route('/uploads/<path:filename>')
-    def serve_photo(filename):
+    from werkzeug.security import safe_join
+    import photo_store
+
+    def _upload_directory():
         # upload_dir = app.config['UPLOAD_FOLDER'] # 这是相对路径名，例如 'uploads'
         # directory = os.path.join(app.root_path, upload_dir) # 构建绝对路径
         # 如果 UPLOAD_FOLDER 在 config.py 中已经是绝对路径，则直接使用
         upload_folder_config = app.config.get('UPLOAD_FOLDER')
         if not upload_folder_config:
-            return "UPLOAD_FOLDER not configured", 500
-        
+            return None
         if not os.path.isabs(upload_folder_config):
-            directory = os.path.join(app.root_path, upload_folder_config)
-        else:
-            directory = upload_folder_config
-            
-        return send_from_directory(directory, filename)
+            return os.path.join(app.root_path, upload_folder_config)
+        return upload_folder_config
+
+    def _send_photo(directory, filename):
+        # 照片文件名是随机生成的，内容不会变化，可以让浏览器长时间缓存；
+        # send_from_directory 会附带 ETag / Last-Modified，并对 If-None-Match / If-Modified-Since 返回 304。
+        # 照片包含人脸信息，只允许浏览器缓存 (private)，不允许 CDN 等共享缓存保存
+        response = send_from_directory(directory, filename, max_age=app.config.get('PHOTO_CACHE_MAX_AGE', 86400))
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+
+    @app.route('/uploads/<path:filename>')
+    def serve_photo(filename):
+        directory = _upload_directory()
+        if directory is None:
+            return "UPLOAD_FOLDER not configured", 500
+        return _send_photo(directory, filename)
+
+    @app.route('/thumbnails/<path:filename>')
+    def serve_thumbnail(filename):
+        """返回照片的缩略图 (filename 与 serve_photo 相同)；旧照片没有缩略图时在这里补生成。"""
+        directory = _upload_directory()
+        if directory is None:
+            return "UPLOAD_FOLDER not configured", 500
+        if safe_join(directory, filename) is None: # 不允许访问上传目录之外的文件
+            return jsonify(message="照片不存在"), 404
+        thumbnail = photo_store.ensure_thumbnail(
+            directory, filename, app.config.get('THUMBNAIL_SIZE', photo_store.DEFAULT_THUMBNAIL_SIZE))
+        if thumbnail is None:
+            return jsonify(message="照片不存在"), 404
+        return _send_photo(directory, thumbnail)
+
+    # 初始化人脸编码进程池 (工作进程在第一次编码时才启动)
+    from face_encoder import encoder_pool, EncoderBusyError, EncoderTimeoutError
+    encoder_pool.init_app(app)
+
+    @app.errorhandler(EncoderBusyError)
+    def handle_encoder_busy(e):
+        return jsonify(message="服务器繁忙，请稍后重试"), 503, {'Retry-After': '1'}
+
+    @app.errorhandler(EncoderTimeoutError)
+    def handle_encoder_timeout(e):
+        return jsonify(message="人脸识别处理超时，请稍后重试"), 504
+
+    # 初始化签到去抖 (同一用户在时间窗口内的重复签到不写数据库)
+    from signin_debounce import signin_debouncer
+    signin_debouncer.init_app(app)
+
+    # 请求/阶段耗时指标、GET /metrics (Prometheus 文本格式) 以及结构化请求日志
+    import metrics
+    metrics.init_app(app)
+
+    # 注册 Flask CLI 命令 (例如 flask migrate-face-data)
+    from commands import register_commands
+    register_commands(app)
 
     # 注册蓝图
     from routes.auth import auth_bp
@@ -0,0 +1,169 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.responses import JSONResponse
+from starlette.routing import Route, Mount
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+import data_store
+import metrics
+import photo_store
+from async_store import async_store
+from face_encoder import encoder_pool, EncoderBusyError, EncoderTimeoutError
+
+# ASGI 运行模式 (高并发签到终端)：
+#     uvicorn asgi:create_asgi_app --factory --host 0.0.0.0 --port 8000
+# POST /attendance/sign 和 POST /user/register 由下面的异步视图处理：
+#   - 上传内容异步读取，慢速上传的终端不占用线程；
+#   - dlib 编码在 encoder_pool 的工作进程中执行，通过 asyncio 等待结果；
+#   - 签到记录和新用户通过异步数据库驱动 (aiomysql / aiosqlite) 写入。
+# 其余接口 (登录、管理、记录查询等) 仍由 Flask 应用处理，经 WSGI 适配层在线程池中运行。
+# 依赖: starlette, python-multipart, a2wsgi, uvicorn，以及 aiomysql 或 aiosqlite。
+
+def _json(status_code, headers=None, **payload):
+    return JSONResponse(payload, status_code=status_code, headers=headers)
+
+def _is_true(value):
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+async def _read_upload(form, field):
+    """读取表单中的上传文件，返回 (filename, bytes)；字段缺失或不是文件时返回 (None, None)。"""
+    upload = form.get(field)
+    if not isinstance(upload, UploadFile):
+        return None, None
+    return upload.filename or '', await upload.read()
+
+async def sign_in(request):
+    """与 Flask 的 POST /attendance/sign 行为一致 (包括 multi=1 多人签到)。"""
+    async with request.form() as form:
+        filename, image_bytes = await _read_upload(form, 'photo')
+        multi = _is_true(request.query_params.get('multi') or form.get('multi'))
+    if image_bytes is None:
+        return _json(400, message="缺少签到照片文件")
+    if filename == '':
+        return _json(400, message="未选择签到照片文件")
+
+    config = request.app.state.flask_app.config
+    faces = await encoder_pool.encode_async(image_bytes)
+    if multi:
+        return await _multi_face_sign_in(faces, config)
+
+    if not faces:
+        metrics.MATCH_TOTAL.inc(result='no_face')
+        return _json(500, message="签到照片人脸数据提取失败")
+    tolerance = config.get('FACE_MATCH_TOLERANCE', 0.6)
+    matched_user_id, distance = data_store.match_face(faces[0]['encoding'], tolerance=tolerance)
+    if not matched_user_id:
+        return _json(404, message="签到失败：未匹配到用户")
+
+    recorded = await async_store.record_attendance([matched_user_id])
+    if recorded is None:
+        return _json(500, message="签到失败，无法记录签到数据")
+    signed = recorded.get(matched_user_id)
+    if not signed:
+        return _json(500, message="签到失败：匹配到的用户在数据库中不存在")
+    if not signed['duplicate']:
+        await async_store.apply_adaptive_sample(matched_user_id, faces[0]['encoding'], distance, config)
+    message = f"用户 {signed['name']} 已于 {signed['timestamp']} 签到" if signed['duplicate'] else f"用户 {signed['name']} 签到成功"
+    return _json(200, message=message, user_id=matched_user_id,
+                 timestamp=signed['timestamp'], duplicate=signed['duplicate'])
+
+async def _multi_face_sign_in(faces, config):
+    if faces is None:
+        return _json(500, message="签到照片人脸数据提取失败")
+    if not faces:
+        metrics.MATCH_TOTAL.inc(result='no_face')
+        return _json(404, message="签到失败：照片中未检测到人脸", faces=[])
+
+    tolerance = config.get('FACE_MATCH_TOLERANCE', 0.6)
+    k = config.get('FACE_MULTI_CANDIDATES', 3)
+    nearest_list = data_store.identify_faces_batch([face['encoding'] for face in faces], k=k)
+    assigned = data_store.assign_unique_identities(nearest_list, tolerance=tolerance)
+
+    recorded = await async_store.record_attendance([match[0] for match in assigned if match])
+    if recorded is None:
+        return _json(500, message="签到失败，无法记录签到数据")
+
+    results = []
+    for face, match in zip(faces, assigned):
+        top, right, bottom, left = face['box']
+        result = {'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left}}
+        signed = recorded.get(match[0]) if match else None
+        if signed:
+            result.update(status='signed', user_id=match[0], distance=round(match[1], 4), **signed)
+        else:
+            result['status'] = 'no_match'
+        results.append(result)
+
+    if not recorded:
+        return _json(404, message="签到失败：未匹配到用户", faces=results)
+    return _json(200, message=f"检测到 {len(faces)} 张人脸，{len(recorded)} 位用户签到成功", faces=results)
+
+async def register_user(request):
+    """与 Flask 的 POST /user/register 行为一致。"""
+    async with request.form() as form:
+        name = form.get('name')
+        filename, image_bytes = await _read_upload(form, 'photo')
+    if not isinstance(name, str) or image_bytes is None:
+        return _json(400, message="缺少姓名或照片文件")
+    if filename == '':
+        return _json(400, message="未选择照片文件")
+
+    config = request.app.state.flask_app.config
+    upload_folder = config['UPLOAD_FOLDER']
+    try:
+        # 磁盘写入和缩略图生成放到线程中，不阻塞事件循环
+        photo_filename = await asyncio.to_thread(
+            photo_store.save_photo, upload_folder, image_bytes,
+            thumbnail_size=config.get('THUMBNAIL_SIZE', photo_store.DEFAULT_THUMBNAIL_SIZE))
+        print(f"照片已保存到: {photo_store.photo_path(upload_folder, photo_filename)}")
+    except OSError as e:
+        print(f"保存照片失败: {e}")
+        return _json(500, message="人脸数据提取或照片保存失败")
+
+    faces = await encoder_pool.encode_async(image_bytes)
+    if not faces:
+        return _json(500, message="人脸数据提取或照片保存失败")
+
+    user_id, user_name = await async_store.add_user(name, faces[0]['encoding'], photo_filename)
+    if user_id is None:
+        return _json(500, message="用户注册失败，无法写入数据库")
+    return _json(201, message="用户注册成功，已存储人脸数据和照片", user_id=user_id, name=user_name, photo_filename=photo_filename)
+
+def _instrumented(endpoint, handler):
+    """包装异步视图：记录请求耗时指标和结构化请求日志，并把编码进程池的错误转换为 503 / 504。"""
+    async def view(request):
+        with metrics.RequestTracker(endpoint, request.method, request.url.path) as tracker:
+            try:
+                response = await handler(request)
+            except EncoderBusyError:
+                response = _json(503, headers={'Retry-After': '1'}, message="服务器繁忙，请稍后重试")
+            except EncoderTimeoutError:
+                response = _json(504, message="人脸识别处理超时，请稍后重试")
+            tracker.status = response.status_code
+            return response
+    return view
+
+def create_asgi_app(flask_app=None):
+    """创建 ASGI 应用：异步签到/注册视图 + 挂载在根路径上的 Flask 应用 (处理其余所有接口)。"""
+    flask_app = flask_app or create_app()
+    async_store.init_app(flask_app)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await async_store.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/attendance/sign', _instrumented('attendance.sign_in_route', sign_in), methods=['POST']),
+            Route('/user/register', _instrumented('user.register_user_route', register_user), methods=['POST']),
+            Mount('/', app=WSGIMiddleware(flask_app, workers=flask_app.config.get('ASGI_WSGI_THREADS', 10))),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.flask_app = flask_app
+    return app
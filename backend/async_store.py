@@ -0,0 +1,148 @@
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from models import db, User
+import data_store
+from signin_debounce import signin_debouncer
+from face_index import gallery_index, bytes_to_encoding
+import metrics
+
+# ASGI 模式的数据库访问层：与 data_store 使用相同的表和写入逻辑，但通过异步驱动执行，
+# 等待数据库时不占用线程。同步的写入函数 (data_store.write_attendance 等) 通过 AsyncSession.run_sync 复用。
+
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql', # 需要安装 aiomysql
+    'sqlite': 'sqlite+aiosqlite', # 需要安装 aiosqlite (本地调试/测试)
+}
+
+def async_database_url(url):
+    """把同步数据库 URL (sqlalchemy.engine.URL) 换成对应的异步驱动。"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"不支持的异步数据库: {backend}，请设置 ASYNC_DATABASE_URI")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+class AsyncStore:
+    """异步数据库引擎及 ASGI 签到/注册路径使用的读写函数。"""
+
+    def __init__(self):
+        self.engine = None
+        self._sessionmaker = None
+
+    def init_app(self, app):
+        uri = app.config.get('ASYNC_DATABASE_URI')
+        if not uri:
+            with app.app_context():
+                # 使用 Flask-SQLAlchemy 解析后的 URL (SQLite 相对路径已转换为 instance 目录下的绝对路径)
+                uri = async_database_url(db.engine.url)
+        self.engine = create_async_engine(uri, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        self._sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def get_user_names(self, user_ids):
+        """data_store.get_user_names 的异步版本：优先读取人脸库索引的元数据，其余用户一次批量查询。"""
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            metadata = gallery_index.get_metadata(user_id)
+            if metadata is not None:
+                names[user_id] = metadata['name']
+            else:
+                missing.append(user_id)
+        if missing:
+            try:
+                async with self._sessionmaker() as session:
+                    rows = await session.execute(select(User.id, User.name).where(User.id.in_(missing)))
+                    names.update({user_id: name for user_id, name in rows})
+            except SQLAlchemyError as e:
+                print(f"批量查询用户失败: {e}")
+        return names
+
+    async def _commit_attendance(self, user_ids, timestamp):
+        """(Internal) 与 data_store._commit_attendance 相同：一个事务内写入签到记录和日汇总，主键冲突时重试一次。"""
+        for attempt in range(2):
+            async with self._sessionmaker() as session:
+                try:
+                    with metrics.timed('db_write'):
+                        await session.run_sync(data_store.write_attendance, user_ids, timestamp)
+                        await session.commit()
+                    return
+                except IntegrityError:
+                    await session.rollback()
+                    if attempt == 1:
+                        raise
+
+    async def record_attendance(self, user_ids):
+        """data_store.record_attendance 的异步版本，返回值相同 (写入数据库失败时返回 None)。"""
+        results, fresh_user_ids = data_store.check_recent_signins(user_ids)
+        if not fresh_user_ids:
+            return results
+
+        names = await self.get_user_names(fresh_user_ids)
+        timestamp = datetime.utcnow()
+        claimed_user_ids = data_store.claim_signins(fresh_user_ids, names, timestamp, results)
+
+        if claimed_user_ids:
+            try:
+                await self._commit_attendance(claimed_user_ids, timestamp)
+                print(f"添加了 {len(claimed_user_ids)} 条签到记录, 时间: {timestamp}")
+            except SQLAlchemyError as e:
+                for user_id in claimed_user_ids:
+                    signin_debouncer.release(user_id) # 写入失败时撤销占用，允许客户端立即重试
+                print(f"添加签到记录到数据库失败: {e}")
+                return None
+        return results
+
+    async def add_user(self, name, face_encoding, photo_filename):
+        """data_store.add_user 的异步版本，返回 (user_id, name)，失败时返回 (None, None)。"""
+        if not face_encoding:
+            print(f"尝试添加用户 {name} 失败，因为人脸数据为空。")
+            return None, None
+
+        new_user_instance = User(name=name, face_encoding=face_encoding, photo_filename=photo_filename)
+        async with self._sessionmaker() as session:
+            try:
+                with metrics.timed('db_write'):
+                    session.add(new_user_instance)
+                    await session.commit()
+            except SQLAlchemyError as e:
+                await session.rollback()
+                print(f"添加用户到数据库失败: {e}")
+                return None, None
+        print(f"用户 {name} 已添加到数据库, ID: {new_user_instance.id}")
+        try:
+            gallery_index.add(new_user_instance.id, bytes_to_encoding(face_encoding), {'name': name}) # 增量更新人脸库索引
+        except ValueError as e:
+            print(f"将用户 {new_user_instance.id} 加入人脸库索引失败: {e}")
+        return new_user_instance.id, new_user_instance.name
+
+    async def apply_adaptive_sample(self, user_id, face_encoding, distance, config):
+        """data_store.apply_adaptive_sample 的异步版本 (写入逻辑通过 run_sync 复用 data_store.write_face_sample)，返回新样本ID或 None。"""
+        if not data_store.should_adapt_sample(user_id, distance, config):
+            return None
+        async with self._sessionmaker() as session:
+            try:
+                with metrics.timed('db_write'):
+                    sample, collected = await session.run_sync(
+                        data_store.write_face_sample, user_id, face_encoding, 'adaptive', None,
+                        config.get('FACE_MAX_SAMPLES_PER_USER', 10), config.get('FACE_ADAPTIVE_MAX_SAMPLES', 3))
+                    if sample is None:
+                        await session.rollback()
+                        return None
+                    await session.commit()
+            except SQLAlchemyError as e:
+                await session.rollback()
+                print(f"添加人脸样本到数据库失败: {e}")
+                return None
+        data_store.refresh_user_samples(user_id, collected)
+        print(f"用户 {user_id} 新增人脸样本 {sample.id} (adaptive)。")
+        return sample.id
+
+# 进程级单例，由 asgi.py 在创建 ASGI 应用时初始化
+async_store = AsyncStore()
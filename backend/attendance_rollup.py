@@ -0,0 +1,139 @@
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import select, update, insert, delete, func, bindparam
+
+from models import db, User, AttendanceRecord, AttendanceDailySummary
+
+# 签到日汇总 (attendance_daily_summary) 的维护与查询
+# - increment_daily_summaries: 与签到记录在同一事务中增量更新，由调用方提交
+# - backfill_daily_summaries: 从原始签到记录重新计算指定日期范围的汇总 (用于历史数据)
+# - get_daily_stats / get_user_stats: 统计接口读取汇总表，不扫描原始记录
+
+Summary = AttendanceDailySummary
+
+def increment_daily_summaries(user_ids, timestamp, session=None):
+    """在当前会话中为每个用户的当天汇总行累加签到次数 (不提交)。
+
+    Args:
+        user_ids (list[str]): 本次签到的用户ID (可重复，重复次数即累加次数)。
+        timestamp (datetime): 本次签到时间 (UTC)，用于确定日期并更新最后签到时间。
+        session: 执行语句的会话，默认为 db.session (ASGI 模式下通过 AsyncSession.run_sync 传入同步会话)。
+    Raises:
+        sqlalchemy.exc.IntegrityError: 并发插入同一汇总行时，调用方应回滚后重试。
+    """
+    counts = Counter(user_ids)
+    if not counts:
+        return
+    session = session if session is not None else db.session
+    day = timestamp.date()
+
+    if len(counts) == 1:
+        # 单个用户签到 (最常见): 先 UPDATE，当天第一次签到时 UPDATE 不到行再 INSERT
+        (user_id, count), = counts.items()
+        result = session.execute(
+            update(Summary)
+            .where(Summary.day == day, Summary.user_id == user_id)
+            .values(sign_in_count=Summary.sign_in_count + count, last_sign_in=timestamp)
+        )
+        if result.rowcount == 0:
+            session.execute(insert(Summary).values(
+                day=day, user_id=user_id, sign_in_count=count,
+                first_sign_in=timestamp, last_sign_in=timestamp))
+        return
+
+    # 多个用户: 一次查询已有的汇总行，然后批量 UPDATE 已有行、批量 INSERT 新行
+    existing = set(session.execute(
+        select(Summary.user_id).where(Summary.day == day, Summary.user_id.in_(list(counts)))
+    ).scalars())
+    updates = [{'b_user_id': user_id, 'b_count': count} for user_id, count in counts.items() if user_id in existing]
+    inserts = [
+        {'day': day, 'user_id': user_id, 'sign_in_count': count, 'first_sign_in': timestamp, 'last_sign_in': timestamp}
+        for user_id, count in counts.items() if user_id not in existing
+    ]
+    if updates:
+        session.execute(
+            update(Summary.__table__)
+            .where(Summary.__table__.c.day == day, Summary.__table__.c.user_id == bindparam('b_user_id'))
+            .values(sign_in_count=Summary.__table__.c.sign_in_count + bindparam('b_count'), last_sign_in=timestamp),
+            updates
+        )
+    if inserts:
+        session.execute(insert(Summary), inserts)
+
+def backfill_daily_summaries(start_day=None, end_day=None):
+    """根据原始签到记录重新计算 [start_day, end_day] (包含两端，UTC 日期) 的日汇总并提交。
+
+    先删除该范围内已有的汇总行，再用一条 INSERT ... SELECT ... GROUP BY 在数据库内完成聚合。
+    Returns:
+        int: 写入的汇总行数。
+    """
+    day_expr = func.date(AttendanceRecord.timestamp)
+    aggregate = select(
+        day_expr.label('day'),
+        AttendanceRecord.user_id,
+        func.count(AttendanceRecord.id),
+        func.min(AttendanceRecord.timestamp),
+        func.max(AttendanceRecord.timestamp),
+    ).group_by(day_expr, AttendanceRecord.user_id)
+    clear = delete(Summary)
+    if start_day is not None:
+        aggregate = aggregate.where(AttendanceRecord.timestamp >= start_day)
+        clear = clear.where(Summary.day >= start_day)
+    if end_day is not None:
+        aggregate = aggregate.where(AttendanceRecord.timestamp < end_day + timedelta(days=1))
+        clear = clear.where(Summary.day <= end_day)
+
+    try:
+        db.session.execute(clear)
+        result = db.session.execute(insert(Summary).from_select(
+            ['day', 'user_id', 'sign_in_count', 'first_sign_in', 'last_sign_in'], aggregate))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result.rowcount
+
+def _filtered(query, start_day, end_day, user_id):
+    if start_day is not None:
+        query = query.where(Summary.day >= start_day)
+    if end_day is not None:
+        query = query.where(Summary.day <= end_day)
+    if user_id is not None:
+        query = query.where(Summary.user_id == user_id)
+    return query
+
+def get_daily_stats(start_day=None, end_day=None, user_id=None):
+    """按天统计: 每天的签到总次数和签到人数，按日期升序。"""
+    query = _filtered(
+        select(Summary.day, func.sum(Summary.sign_in_count), func.count(Summary.user_id))
+        .group_by(Summary.day)
+        .order_by(Summary.day),
+        start_day, end_day, user_id)
+    return [
+        {'day': day.strftime("%Y-%m-%d") if hasattr(day, 'strftime') else str(day),
+         'sign_in_count': int(total), 'user_count': int(users)}
+        for day, total, users in db.session.execute(query)
+    ]
+
+def get_user_stats(start_day=None, end_day=None, user_id=None):
+    """按用户统计: 每个用户的签到总次数、签到天数以及首次/最后签到时间，按签到次数降序。"""
+    total = func.sum(Summary.sign_in_count)
+    query = _filtered(
+        select(Summary.user_id, User.name, total, func.count(Summary.day),
+               func.min(Summary.first_sign_in), func.max(Summary.last_sign_in))
+        .join(User, Summary.user_id == User.id)
+        .group_by(Summary.user_id, User.name)
+        .order_by(total.desc(), Summary.user_id),
+        start_day, end_day, user_id)
+    return [
+        {
+            'user_id': row_user_id,
+            'name': name,
+            'sign_in_count': int(count),
+            'days': int(days),
+            'first_sign_in': first.strftime("%Y-%m-%d %H:%M:%S"),
+            'last_sign_in': last.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        for row_user_id, name, count, days, first, last in db.session.execute(query)
+    ]
@@ -0,0 +1,288 @@
+"""人脸签到流水线基准测试 (离线运行，每个规模使用一个临时 SQLite 数据库)。
+
+为每个人脸库规模生成合成的 128 维人脸编码和签到历史，测量各阶段的延迟分位数和吞吐:
+    encode            人脸编码 (解码 + 检测 + dlib 编码，与人脸库规模无关，只测一次)
+    gallery_load      启动时从数据库加载人脸库索引
+    match             单张人脸比对 (compare_stored_faces)
+    match_batch       批量比对 (identify_faces_batch，吞吐按人脸计)
+    record_insert     记录一次签到 (record_attendance，签到去抖关闭)
+    records_page      签到记录分页 (第一页 / 按游标连续翻页 / 按用户过滤)
+    records_all       全量签到记录列表 (get_all_attendance_records)
+    users_page        用户列表分页 (第一页 / 按游标连续翻页)
+    stats_day         按天统计 (读取日汇总表)
+结果以 JSON 输出，可用 --compare 与之前提交的结果对比。
+
+示例:
+    python benchmark.py --sizes 1000,10000,100000 --output bench.json
+    python benchmark.py --sizes 1000,10000 --compare bench.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import insert
+
+from app import create_app
+from models import db, User, AttendanceRecord, generate_uuid
+import data_store
+import attendance_rollup
+from face_encoder import encoder_pool
+from face_index import encoding_to_bytes, FACE_ENCODING_DIM
+
+INSERT_CHUNK = 10000 # 生成数据时每次批量插入的行数
+ENCODING_STD = 0.09 # 合成编码每维的标准差 (范数约为 1，与 dlib 编码的尺度接近)
+QUERY_NOISE_STD = 0.03 # 查询编码相对注册编码的噪声 (距离约 0.34，在默认阈值 0.6 内)
+
+def summarize(latencies, elapsed=None):
+    """把一组耗时 (秒) 汇总为毫秒分位数和吞吐 (次/秒)。elapsed 为整体耗时，默认为各次耗时之和。"""
+    values = np.sort(np.asarray(latencies, dtype=np.float64)) * 1000
+    elapsed = elapsed if elapsed is not None else values.sum() / 1000
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 4),
+        'p50_ms': round(float(np.percentile(values, 50)), 4),
+        'p95_ms': round(float(np.percentile(values, 95)), 4),
+        'p99_ms': round(float(np.percentile(values, 99)), 4),
+        'max_ms': round(float(values.max()), 4),
+        'throughput_per_s': round(values.size / elapsed, 2) if elapsed else None,
+    }
+
+def measure(fn, inputs):
+    """依次以 inputs 中的每一项调用 fn，返回 summarize 结果。"""
+    latencies = []
+    started = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - started)
+
+def synthetic_image(width=640, height=480, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def base_config(workdir, args):
+    return {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'UPLOAD_FOLDER': workdir,
+        'FACE_INDEX_BACKEND': args.index_backend,
+        'FACE_INDEX_PATH': os.path.join(workdir, 'face_index.npz'),
+        'ENCODER_WORKERS': args.encoder_workers,
+        'ENCODING_CACHE_SIZE': 0, # 测量真实的编码耗时，不使用缓存
+        'ENCODING_CACHE_DIR': None,
+        'SIGNIN_DEDUP_WINDOW_SECONDS': 0, # 每次签到都写数据库
+    }
+
+def bench_encode(args):
+    """测量人脸编码，图片来自 --photo (建议使用真实人脸照片) 或合成的噪声图片。"""
+    with tempfile.TemporaryDirectory() as workdir:
+        app = create_app(base_config(workdir, args))
+        if args.photo:
+            with open(args.photo, 'rb') as f:
+                image_bytes = f.read()
+        else:
+            image_bytes = synthetic_image()
+        with app.app_context():
+            encoder_pool.encode(image_bytes) # 预热 (工作进程启动、模型加载)
+            results = {'encode': measure(encoder_pool.encode, [image_bytes] * args.encode_samples)}
+            if args.encoder_workers > 0:
+                started = time.perf_counter()
+                encoder_pool.encode_many([image_bytes] * args.encode_samples)
+                elapsed = time.perf_counter() - started
+                results['encode_parallel'] = {'count': args.encode_samples,
+                                              'throughput_per_s': round(args.encode_samples / elapsed, 2)}
+        encoder_pool.shutdown()
+    return results
+
+def populate(size, args, rng):
+    """写入 size 个合成用户和签到历史，返回 (用户ID列表, 编码矩阵, 签到记录数)。"""
+    encodings = rng.normal(0.0, ENCODING_STD, size=(size, FACE_ENCODING_DIM)).astype(np.float32)
+    user_ids = [generate_uuid() for _ in range(size)]
+    created_at = datetime.utcnow()
+    for start in range(0, size, INSERT_CHUNK):
+        db.session.execute(insert(User), [
+            {'id': user_ids[i], 'name': f"user{i}", 'face_encoding': encoding_to_bytes(encodings[i]),
+             'photo_filename': f"{user_ids[i]}.jpg", 'created_at': created_at}
+            for i in range(start, min(start + INSERT_CHUNK, size))
+        ])
+    db.session.commit()
+
+    history = min(size * args.history_per_user, args.history_max)
+    end = datetime.utcnow()
+    span = args.history_days * 86400
+    for start in range(0, history, INSERT_CHUNK):
+        count = min(INSERT_CHUNK, history - start)
+        offsets = rng.integers(0, span, size=count)
+        owners = rng.integers(0, size, size=count)
+        db.session.execute(insert(AttendanceRecord), [
+            {'user_id': user_ids[owner], 'timestamp': end - timedelta(seconds=int(offset))}
+            for owner, offset in zip(owners, offsets)
+        ])
+    db.session.commit()
+    return user_ids, encodings, history
+
+def bench_size(size, args):
+    rng = np.random.default_rng(args.seed + size)
+    picker = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        app = create_app(base_config(workdir, args))
+        with app.app_context():
+            print(f"[{size}] 生成合成人脸库和签到历史...")
+            user_ids, encodings, history = populate(size, args, rng)
+            results = {'users': size, 'history_records': history}
+
+            started = time.perf_counter()
+            attendance_rollup.backfill_daily_summaries()
+            results['rollup_backfill'] = summarize([time.perf_counter() - started])
+            started = time.perf_counter()
+            data_store.rebuild_gallery_index()
+            data_store.setup_gallery_ann(app.config, force_train=args.index_backend != 'flat')
+            results['gallery_load'] = summarize([time.perf_counter() - started])
+
+            # 查询: 大部分是已注册用户加噪声，其余是陌生人 (不应匹配)
+            owners = rng.integers(0, size, size=args.queries)
+            queries = encodings[owners] + rng.normal(0.0, QUERY_NOISE_STD, size=(args.queries, FACE_ENCODING_DIM)).astype(np.float32)
+            strangers = rng.random(args.queries) < args.stranger_ratio
+            queries[strangers] = rng.normal(0.0, ENCODING_STD, size=(int(strangers.sum()), FACE_ENCODING_DIM))
+            query_bytes = [encoding_to_bytes(query) for query in queries]
+
+            tolerance = app.config.get('FACE_MATCH_TOLERANCE', 0.6)
+            matched = [data_store.compare_stored_faces(query, tolerance=tolerance) for query in query_bytes[:200]]
+            expected = [None if stranger else user_ids[owner] for owner, stranger in zip(owners[:200], strangers[:200])]
+            results['match_accuracy'] = round(sum(a == b for a, b in zip(matched, expected)) / len(expected), 4)
+            results['match'] = measure(lambda query: data_store.compare_stored_faces(query, tolerance=tolerance), query_bytes)
+
+            batches = [query_bytes[i:i + args.batch_size] for i in range(0, len(query_bytes), args.batch_size)]
+            started = time.perf_counter()
+            batch_stats = measure(data_store.identify_faces_batch, batches)
+            batch_stats['faces_per_s'] = round(len(query_bytes) / (time.perf_counter() - started), 2)
+            results['match_batch'] = batch_stats
+
+            sign_ins = [picker.choice(user_ids) for _ in range(args.inserts)]
+            results['record_insert'] = measure(lambda user_id: data_store.record_attendance([user_id]), sign_ins)
+
+            results['records_page_first'] = measure(
+                lambda _: data_store.get_attendance_records_page(limit=args.page_size), range(args.page_samples))
+            cursor_state = {'cursor': None}
+            def next_page(_):
+                _, cursor_state['cursor'] = data_store.get_attendance_records_page(
+                    limit=args.page_size, cursor=cursor_state['cursor'])
+            results['records_page_walk'] = measure(next_page, range(args.page_samples))
+            results['records_page_user'] = measure(
+                lambda user_id: data_store.get_attendance_records_page(limit=args.page_size, user_id=user_id),
+                [picker.choice(user_ids) for _ in range(args.page_samples)])
+            if history <= args.all_records_max:
+                results['records_all'] = measure(lambda _: data_store.get_all_attendance_records(), range(args.all_records_samples))
+            results['users_page_first'] = measure(
+                lambda _: data_store.get_users_page(limit=args.page_size), range(args.page_samples))
+            users_cursor = {'cursor': None}
+            def next_users_page(_):
+                _, users_cursor['cursor'] = data_store.get_users_page(limit=args.page_size, cursor=users_cursor['cursor'])
+            results['users_page_walk'] = measure(next_users_page, range(args.page_samples))
+            results['stats_day'] = measure(lambda _: data_store.get_attendance_stats('day'), range(args.page_samples))
+            db.session.remove()
+        encoder_pool.shutdown()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, current, threshold):
+    """逐阶段对比 p50/p95，返回变慢超过 threshold 倍的 (规模, 阶段, 指标, 旧值, 新值) 列表。"""
+    regressions = []
+    for size, stages in current['results'].items():
+        old_stages = baseline.get('results', {}).get(size, {})
+        for stage, stats in stages.items():
+            old = old_stages.get(stage)
+            if not isinstance(stats, dict) or not isinstance(old, dict):
+                continue
+            for metric in ('p50_ms', 'p95_ms'):
+                if metric not in stats or not old.get(metric):
+                    continue
+                ratio = stats[metric] / old[metric]
+                flag = ' <-- 变慢' if ratio > threshold else ''
+                print(f"  {size:>8} {stage:<20} {metric}: {old[metric]:>10.3f} -> {stats[metric]:>10.3f} ms (x{ratio:.2f}){flag}")
+                if ratio > threshold:
+                    regressions.append((size, stage, metric, old[metric], stats[metric]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="人脸签到流水线基准测试 (离线，SQLite)")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="人脸库规模，逗号分隔")
+    parser.add_argument('--photo', help="用于测量编码的照片 (默认使用合成图片)")
+    parser.add_argument('--encode-samples', type=int, default=20)
+    parser.add_argument('--encoder-workers', type=int, default=0, help="编码进程数，0 表示在当前进程中编码")
+    parser.add_argument('--skip-encode', action='store_true', help="跳过编码阶段 (没有安装 dlib 时)")
+    parser.add_argument('--index-backend', default='flat', choices=['flat', 'ivfpq'])
+    parser.add_argument('--queries', type=int, default=1000, help="比对阶段的查询数")
+    parser.add_argument('--stranger-ratio', type=float, default=0.1, help="查询中陌生人 (不应匹配) 的比例")
+    parser.add_argument('--batch-size', type=int, default=32, help="批量比对每批的人脸数")
+    parser.add_argument('--inserts', type=int, default=500, help="签到写入次数")
+    parser.add_argument('--history-per-user', type=int, default=10, help="每个用户的历史签到记录数")
+    parser.add_argument('--history-max', type=int, default=500000, help="历史签到记录总数上限")
+    parser.add_argument('--history-days', type=int, default=30, help="历史签到分布的天数")
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--page-samples', type=int, default=50)
+    parser.add_argument('--all-records-max', type=int, default=200000, help="历史记录超过该数量时跳过 records_all")
+    parser.add_argument('--all-records-samples', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="结果 JSON 文件 (默认输出到标准输出)")
+    parser.add_argument('--compare', help="与之前的结果 JSON 对比")
+    parser.add_argument('--regression-threshold', type=float, default=1.2, help="新旧耗时之比超过该值视为变慢")
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': {},
+    }
+    if not args.skip_encode:
+        print("测量人脸编码...")
+        report['results']['encode'] = bench_encode(args)
+    for size in [int(value) for value in args.sizes.split(',') if value.strip()]:
+        report['results'][str(size)] = bench_size(size, args)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"基准测试结果已写入 {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"与 {args.compare} (commit {baseline.get('meta', {}).get('commit')}) 对比:")
+        regressions = compare(baseline, report, args.regression_threshold)
+        if regressions:
+            print(f"{len(regressions)} 项指标变慢超过 {args.regression_threshold} 倍。")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
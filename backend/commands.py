@@ -0,0 +1,254 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import click
+from flask import current_app
+from sqlalchemy import inspect, text
+
+from models import db, User, FaceEncoding
+from face_index import gallery_index
+from face_encoder import encode_image_file, init_worker
+import data_store
+import attendance_rollup
+import photo_store
+
+# Flask CLI 命令，通过 register_commands(app) 在 create_app 中注册
+# 用法示例: flask --app app:create_app migrate-face-data
+
+def _ensure_face_encoding_schema():
+    """为已存在的旧表补充 face_encoding 列，并放开 face_data 的 NOT NULL 约束。
+
+    db.create_all() 不会修改已存在的表，因此旧库需要执行一次此迁移。
+    """
+    engine = db.engine
+    columns = {column['name']: column for column in inspect(engine).get_columns(User.__tablename__)}
+
+    with engine.begin() as conn:
+        if 'face_encoding' not in columns:
+            column_type = User.__table__.c.face_encoding.type.compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {User.__tablename__} ADD COLUMN face_encoding {column_type} NULL"))
+            click.echo("已添加 face_encoding 列。")
+
+        if not columns['face_data']['nullable']:
+            if engine.dialect.name == 'mysql':
+                conn.execute(text(f"ALTER TABLE {User.__tablename__} MODIFY face_data TEXT NULL"))
+                click.echo("已将 face_data 列修改为可为空。")
+            else:
+                click.echo(f"警告: 当前数据库 ({engine.dialect.name}) 不支持直接修改 face_data 为可为空，"
+                           "新用户只写入 face_encoding 列时可能失败，请手动迁移表结构。")
+
+@click.command('migrate-face-data')
+@click.option('--batch-size', default=500, show_default=True, help='每批回填的用户数量。')
+@click.option('--keep-json', is_flag=True, help='回填后保留旧的 JSON face_data 内容。')
+def migrate_face_data_command(batch_size, keep_json):
+    """将旧的 JSON 人脸编码转换为 512 字节的 float32 二进制格式。"""
+    _ensure_face_encoding_schema()
+    migrated, skipped = data_store.migrate_legacy_face_data(batch_size=batch_size, keep_json=keep_json)
+    click.echo(f"迁移完成: 转换 {migrated} 个用户，跳过 {skipped} 个无法解析的用户。")
+
+@click.command('build-face-index')
+@click.option('--nlist', type=int, default=None, help='粗聚类簇数，默认使用配置 FACE_INDEX_NLIST。')
+def build_face_index_command(nlist):
+    """从数据库训练 IVF-PQ 近似最近邻索引，并保存到 FACE_INDEX_PATH。"""
+    config = dict(current_app.config)
+    config['FACE_INDEX_BACKEND'] = 'ivfpq'
+    if nlist:
+        config['FACE_INDEX_NLIST'] = nlist
+    if not config.get('FACE_INDEX_PATH'):
+        raise click.ClickException("未配置 FACE_INDEX_PATH")
+    if not data_store.setup_gallery_ann(config, force_train=True):
+        raise click.ClickException("ANN 索引训练失败")
+    click.echo(f"索引已保存到 {config['FACE_INDEX_PATH']}，共 {gallery_index.user_count} 个用户。")
+
+@click.command('ensure-indexes')
+def ensure_indexes_command():
+    """为已存在的表补建 models.py 中声明的索引 (db.create_all() 不会给已存在的表加索引)。"""
+    engine = db.engine
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                click.echo(f"已创建索引 {index.name} ({table.name})")
+    click.echo("索引检查完成。")
+
+@click.command('rollup-backfill')
+@click.option('--from', 'start_day', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='起始日期 (UTC，包含)，默认不限。')
+@click.option('--to', 'end_day', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='结束日期 (UTC，包含)，默认不限。')
+def rollup_backfill_command(start_day, end_day):
+    """根据原始签到记录重新计算签到日汇总 (首次上线或修复历史数据时执行)。"""
+    rows = attendance_rollup.backfill_daily_summaries(
+        start_day.date() if start_day else None,
+        end_day.date() if end_day else None,
+    )
+    click.echo(f"日汇总回填完成，共写入 {rows} 行。")
+
+@click.command('shard-photos')
+@click.option('--batch-size', default=500, show_default=True, help='每批迁移的照片数量。')
+def shard_photos_command(batch_size):
+    """把旧版本保存在 UPLOAD_FOLDER 根目录下的照片移动到按哈希分片的子目录，并更新数据库中的文件名。
+
+    每批先移动文件再提交，中断后重新执行会继续迁移剩余的照片 (已迁移的照片文件名中带有分片目录)。
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    moved = 0
+    for model in (User, FaceEncoding):
+        while True:
+            rows = model.query.filter(model.photo_filename.isnot(None), ~model.photo_filename.contains('/')) \
+                .limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                row.photo_filename = photo_store.move_to_shard(upload_folder, row.photo_filename)
+            db.session.commit()
+            moved += len(rows)
+            click.echo(f"已迁移 {moved} 张照片...")
+    click.echo(f"照片分片迁移完成，共迁移 {moved} 张照片。")
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+def _iter_enroll_sources(source):
+    """(Internal) 生成 (姓名, 图片路径)。source 为目录时按文件名 (不含扩展名) 作为姓名；
+    为 CSV 文件时读取 name,photo 两列，photo 为相对 CSV 所在目录的路径或绝对路径。"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                stem, ext = os.path.splitext(filename)
+                if ext.lower() in IMAGE_EXTENSIONS:
+                    yield stem, os.path.abspath(os.path.join(root, filename))
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                name = (row.get('name') or '').strip()
+                photo = (row.get('photo') or '').strip()
+                if name and photo:
+                    yield name, os.path.abspath(os.path.join(base_dir, photo))
+
+def _load_enroll_state(state_file):
+    """(Internal) 读取断点文件，返回已成功导入的图片路径集合。"""
+    done = set()
+    if not os.path.exists(state_file):
+        return done
+    with open(state_file, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # 中断时可能留下写了一半的最后一行
+            if entry.get('status') == 'enrolled':
+                done.add(entry['source'])
+    return done
+
+@click.command('enroll-bulk')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='编码工作进程数。')
+@click.option('--batch-size', default=200, show_default=True, help='每批插入数据库的用户数量。')
+@click.option('--state-file', default=None, help='断点文件 (JSON Lines)，默认为 instance/enroll-<来源哈希>.jsonl。')
+def enroll_bulk_command(source, workers, batch_size, state_file):
+    """批量导入用户：SOURCE 为照片目录 (文件名即姓名) 或 name,photo 两列的 CSV 清单。
+
+    照片在进程池中并行编码，结果分批批量插入数据库。每批提交后把已导入的照片写入断点文件，
+    中断后重新执行同一命令会跳过已导入的照片。
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    thumbnail_size = current_app.config.get('THUMBNAIL_SIZE', photo_store.DEFAULT_THUMBNAIL_SIZE)
+    if state_file is None:
+        source_hash = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:12]
+        state_file = os.path.join('instance', f"enroll-{source_hash}.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+
+    done = _load_enroll_state(state_file)
+    pending = [(name, path) for name, path in _iter_enroll_sources(source) if path not in done]
+    click.echo(f"待导入 {len(pending)} 张照片 (已跳过 {len(done)} 张之前导入过的照片)，断点文件: {state_file}")
+    if not pending:
+        return
+
+    from face_encoder import encoder_pool
+    options = encoder_pool.options
+    counts = {'enrolled': 0, 'no_face': 0, 'error': 0}
+    failures = []
+    buffer = [] # (姓名, 图片路径, 编码)
+    started = time.perf_counter()
+
+    def flush(state):
+        if not buffer:
+            return
+        users = []
+        for name, path, face_encoding in buffer:
+            photo_filename = photo_store.copy_photo(upload_folder, path, thumbnail_size)
+            users.append({'name': name, 'face_encoding': face_encoding, 'photo_filename': photo_filename})
+        user_ids = data_store.add_users_bulk(users)
+        if user_ids is None:
+            for user in users: # 插入失败时清理已复制的照片，下次执行会重新导入这一批
+                photo_store.delete_photo(upload_folder, user['photo_filename'])
+            raise click.ClickException("批量插入用户失败，已导入的批次不受影响，可重新执行命令继续导入")
+        for (name, path, _), user_id in zip(buffer, user_ids):
+            state.write(json.dumps({'source': path, 'status': 'enrolled', 'user_id': user_id, 'name': name}, ensure_ascii=False) + '\n')
+        state.flush()
+        counts['enrolled'] += len(buffer)
+        buffer.clear()
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+    )
+    in_flight = {}
+    queue = iter(pending)
+    try:
+        with open(state_file, 'a', encoding='utf-8') as state:
+            while True:
+                # 控制同时在途的任务数，避免一次性提交全部照片
+                while len(in_flight) < workers * 4:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    in_flight[executor.submit(encode_image_file, item[1], options)] = item
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, path = in_flight.pop(future)
+                    faces = future.result()['faces']
+                    if faces is None:
+                        counts['error'] += 1
+                        failures.append((path, '无法读取或解码'))
+                    elif not faces:
+                        counts['no_face'] += 1
+                        failures.append((path, '未检测到人脸'))
+                    else:
+                        if len(faces) > 1:
+                            click.echo(f"警告：{path} 中检测到 {len(faces)} 张人脸，将使用第一张。")
+                        buffer.append((name, path, faces[0]['encoding']))
+                if len(buffer) >= batch_size:
+                    flush(state)
+                    processed = sum(counts.values()) + len(buffer)
+                    elapsed = time.perf_counter() - started
+                    click.echo(f"已处理 {processed}/{len(pending)} 张，{processed / elapsed:.1f} 张/秒")
+            flush(state)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    processed = sum(counts.values())
+    click.echo(f"导入完成: 处理 {processed} 张，用时 {elapsed:.1f} 秒 ({processed / elapsed:.1f} 张/秒)。"
+               f"成功 {counts['enrolled']}，未检测到人脸 {counts['no_face']}，读取失败 {counts['error']}。")
+    for path, reason in failures:
+        click.echo(f"  失败: {path} ({reason})")
+    if counts['enrolled']:
+        click.echo("提示: 正在运行的服务需要重启才能把新用户加载到人脸库索引。")
+
+def register_commands(app):
+    app.cli.add_command(migrate_face_data_command)
+    app.cli.add_command(build_face_index_command)
+    app.cli.add_command(enroll_bulk_command)
+    app.cli.add_command(ensure_indexes_command)
+    app.cli.add_command(rollup_backfill_command)
+    app.cli.add_command(shard_photos_command)
@@ -1,14 +1,61 @@
 import os
-import uuid
+import time
+import base64
+import threading
 from datetime import datetime
 import json # 用于序列化和反序列化面部编码列表
 import numpy as np # 用于处理面部编码数组
-import face_recognition # 主要的人脸识别库
 
-from models import db, User, AttendanceRecord # From models.py
-from sqlalchemy.exc import SQLAlchemyError
+from models import db, User, AttendanceRecord, FaceEncoding, generate_uuid # From models.py
+from ann_index import IVFPQIndex
+import attendance_rollup # 签到日汇总的增量维护
+from signin_debounce import signin_debouncer # 重复签到去抖
+import metrics # 阶段耗时与比对结果指标
+import photo_store # 照片的分片存储与缩略图
+from face_encoder import encoder_pool # 人脸编码进程池 (dlib 计算不在请求线程中执行)
+from face_index import gallery_index, encoding_to_bytes, bytes_to_encoding, FACE_ENCODING_BYTES # 进程内常驻的人脸库索引及编码格式
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 
 # --- Private Helper Function for Face Encoding Extraction ---
+def _read_image_bytes(image_file_stream):
+    """(Internal) 读取上传文件的全部字节 (从文件开头读取)，失败时返回 None。"""
+    try:
+        image_file_stream.seek(0) # 重置文件指针到开头，以防之前被读取过
+        return image_file_stream.read()
+    except Exception as e:
+        print(f"读取上传图片时出错: {e}")
+        return None
+
+def _extract_all_face_encodings(image_file_stream):
+    """(Internal) 从图片文件流中提取所有检测到的人脸编码及其位置。
+
+    实际的 dlib 计算由 face_encoder.encoder_pool 在工作进程中完成。
+    队列已满或等待超时时分别抛出 EncoderBusyError / EncoderTimeoutError，由 app.py 中的错误处理器转换为 503 / 504。
+    
+    Args:
+        image_file_stream: werkzeug.datastructures.FileStorage object (上传的文件对象)
+    
+    Returns:
+        list[dict]: 每张人脸一项 {'encoding': 512 字节的二进制编码, 'box': (top, right, bottom, left)}，
+                    未检测到人脸时为空列表。
+        None: 如果发生错误。
+    """
+    image_bytes = _read_image_bytes(image_file_stream)
+    if image_bytes is None:
+        return None
+    return encoder_pool.encode(image_bytes)
+
+def _first_face_encoding(faces):
+    """(Internal) 从提取结果中取第一张人脸的编码，没有人脸或出错时返回 None。"""
+    if not faces: # 出错 (None) 或没有检测到人脸 ([])
+        if faces is not None:
+            print("未在图片中检测到人脸。")
+        return None
+    if len(faces) > 1:
+        print(f"警告：在图片中检测到 {len(faces)} 张人脸。将使用第一张。")
+    return faces[0]['encoding'] # 取第一个人脸的编码
+
 def _extract_face_encoding(image_file_stream):
     """(Internal) 从图片文件流中提取第一个检测到的人脸编码。
     
@@ -16,148 +63,363 @@ def _extract_face_encoding(image_file_stream):
         image_file_stream: werkzeug.datastructures.FileStorage object (上传的文件对象)
     
     Returns:
-        str: JSON 字符串表示的人脸编码 (128个浮点数的列表)，如果找到人脸。
+        bytes: 512 字节的 float32 二进制人脸编码，如果找到人脸。
         None: 如果没有检测到人脸或发生错误。
     """
-    try:
-        # face_recognition.load_image_file可以直接处理文件流或文件路径
-        # 为了确保它能正确处理 FileStorage 对象，最好先读取其内容
-        # image_file_stream.seek(0) # 确保从文件开头读取
-        # image = face_recognition.load_image_file(image_file_stream)
-        
-        # 更直接的方式是 FileStorage 对象通常有一个 `stream` 属性或可以直接传递
-        # 但最安全的是先保存到临时位置或读取到内存中给 face_recognition
-        # 为简单起见，我们假设 face_recognition.load_image_file 可以处理它
-        # 如果不行，需要 image_file_stream.read() 然后用 BytesIO 包装，或者临时保存
-        image_file_stream.seek(0) # 重置文件指针到开头，以防之前被读取过
-        image = face_recognition.load_image_file(image_file_stream)
-        
-        face_encodings = face_recognition.face_encodings(image) # 返回一个包含所有检测到人脸编码的列表
-
-        if face_encodings: # 如果检测到了人脸
-            if len(face_encodings) > 1:
-                print(f"警告：在图片中检测到 {len(face_encodings)} 张人脸。将使用第一张。")
-            first_face_encoding = face_encodings[0] # 取第一个人脸的编码
-            # 将 numpy 数组转换为列表，然后序列化为 JSON 字符串
-            return json.dumps(first_face_encoding.tolist())
-        else:
-            print("未在图片中检测到人脸。")
-            return None
-    except Exception as e:
-        print(f"提取人脸编码时出错: {e}")
-        return None
+    return _first_face_encoding(_extract_all_face_encodings(image_file_stream))
 
 # --- Public Functions ---
 
 # 用于注册：保存照片，并提取特征数据
-def save_photo_and_extract_data(image_file, upload_folder):
+def save_photo_and_extract_data(image_file, upload_folder, thumbnail_size=photo_store.DEFAULT_THUMBNAIL_SIZE):
     """
-    保存上传的人脸图片到指定文件夹, 并提取特征数据。
-    返回 (提取到的特征数据, 保存的照片文件名)。
+    保存上传的人脸图片到指定文件夹 (按哈希分片的子目录) 并生成缩略图, 然后提取特征数据。
+    返回 (提取到的特征数据, 保存的照片文件名 (相对 upload_folder 的路径))。
     """
-    photo_filename = f"{uuid.uuid4()}.jpg"
-    image_path = os.path.join(upload_folder, photo_filename)
+    # 只读取一次上传内容：同一份字节既写入磁盘，也提交给编码进程池，无需保存后再重新读取
+    image_bytes = _read_image_bytes(image_file)
+    if image_bytes is None:
+        return None, None
     try:
-        image_file.save(image_path)
-        print(f"照片已保存到: {image_path}")
+        photo_filename = photo_store.save_photo(upload_folder, image_bytes, thumbnail_size=thumbnail_size)
+        print(f"照片已保存到: {photo_store.photo_path(upload_folder, photo_filename)}")
     except Exception as e:
         print(f"保存照片失败: {e}")
         return None, None # 保存失败则返回 None
 
     # 调用内部函数提取特征数据
-    # image_file 在被 image_file.save() 后，其文件指针可能在末尾，需要重置
-    image_file.seek(0)
-    face_encoding_json = _extract_face_encoding(image_file)
-    return face_encoding_json, photo_filename # face_encoding_json 可能是 None
+    face_encoding = _first_face_encoding(encoder_pool.encode(image_bytes))
+    return face_encoding, photo_filename # face_encoding 可能是 None
 
 # 用于签到：仅提取特征数据，不保存照片
 def extract_face_data_without_saving(image_file):
     """
     处理上传的人脸图片, 仅提取特征数据，不保存原始图片。
-    返回提取到的特征数据 (模拟为字符串)。
+    返回提取到的特征数据 (512 字节的二进制人脸编码)。
     """
-    return _extract_face_encoding(image_file) # face_encoding_json 可能是 None
+    return _extract_face_encoding(image_file) # face_encoding 可能是 None
+
+# 用于多人签到：提取一张合照中的所有人脸，不保存照片
+def extract_all_faces_without_saving(image_file):
+    """
+    处理上传的合照, 提取其中所有人脸的特征数据和位置，不保存原始图片。
+    返回 [{'encoding': bytes, 'box': (top, right, bottom, left)}, ...]，出错时返回 None。
+    """
+    return _extract_all_face_encodings(image_file)
+
+# 用于批量签到：对多张图片提取特征数据，不保存照片
+def extract_face_data_batch(image_files):
+    """
+    处理多张上传的人脸图片，返回与输入顺序一致的特征数据列表 (未检测到人脸的位置为 None)。
+    """
+    image_bytes_list = [_read_image_bytes(image_file) for image_file in image_files]
+    readable = [image_bytes for image_bytes in image_bytes_list if image_bytes is not None]
+    faces_iter = iter(encoder_pool.encode_many(readable)) # 所有图片同时提交到进程池并行编码
+    return [
+        _first_face_encoding(next(faces_iter)) if image_bytes is not None else None
+        for image_bytes in image_bytes_list
+    ]
+
+def _decode_face_encoding(face_encoding):
+    """(Internal) 将二进制 (或旧格式 JSON 字符串) 人脸编码解码为 float32 数组，失败时返回 None。"""
+    try:
+        if isinstance(face_encoding, (bytes, bytearray, memoryview)):
+            return bytes_to_encoding(face_encoding)
+        return np.asarray(json.loads(face_encoding), dtype=np.float32) # 兼容旧格式
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
+        print(f"解析人脸编码时出错: {e}")
+        return None
 
 # Database interaction functions
-def compare_stored_faces(uploaded_face_encoding_json):
+def identify_face(uploaded_face_encoding, k=5):
     """
-    将上传照片提取的特征编码与数据库中所有用户的特征编码进行比对。
+    在人脸库索引中检索与上传人脸距离最近的 k 个用户。
     Args:
-        uploaded_face_encoding_json (str): JSON 字符串表示的待比对人脸编码。
+        uploaded_face_encoding (bytes): 二进制表示的待比对人脸编码。
+        k (int): 返回的候选数量。
     Returns:
-        str: 匹配到的用户ID，如果未匹配到则返回 None。
+        list[tuple[str, float]]: 按距离升序排列的 (user_id, distance) 列表，出错时为空列表。
     """
-    if not uploaded_face_encoding_json:
-        return None
+    if not uploaded_face_encoding:
+        return []
 
-    try:
-        uploaded_encoding_list = json.loads(uploaded_face_encoding_json)
-        uploaded_encoding = np.array(uploaded_encoding_list)
-    except (json.JSONDecodeError, TypeError) as e:
-        print(f"解析上传的人脸编码时出错: {e}")
-        return None
+    uploaded_encoding = _decode_face_encoding(uploaded_face_encoding)
+    if uploaded_encoding is None:
+        return []
+
+    if len(gallery_index) == 0:
+        print("人脸库索引为空，没有用户可供比对。")
+        return []
 
     try:
-        all_users = User.query.all()
-        if not all_users:
-            print("数据库中没有用户可供比对。")
-            return None
+        with metrics.timed('match'):
+            return gallery_index.search(uploaded_encoding, k=k)
+    except ValueError as e:
+        print(f"上传的人脸编码格式不正确: {e}")
+        return []
 
-        known_face_encodings = []
-        user_ids_ordered = []
-
-        for user in all_users:
-            if user.face_data:
-                try:
-                    stored_encoding_list = json.loads(user.face_data)
-                    known_face_encodings.append(np.array(stored_encoding_list))
-                    user_ids_ordered.append(user.id)
-                except (json.JSONDecodeError, TypeError):
-                    print(f"解析用户 {user.id} 的存储面部数据时出错，跳过此用户。")
-                    continue # 跳过这个损坏的数据
-            else:
-                print(f"用户 {user.id} 没有面部数据，跳过此用户。")
-
-        if not known_face_encodings:
-            print("数据库中没有有效的已知人脸编码可供比对。")
-            return None
+def identify_faces_batch(uploaded_face_encodings, k=1):
+    """
+    批量检索：把所有有效的查询编码拼成一个矩阵，与人脸库做一次矩阵-矩阵距离计算。
+    Args:
+        uploaded_face_encodings (list[bytes | None]): 二进制人脸编码列表，None 表示该图片没有提取到人脸。
+        k (int): 每个查询返回的候选数量。
+    Returns:
+        list[list[tuple[str, float]]]: 与输入顺序一致，每项为按距离升序排列的 (user_id, distance) 列表。
+    """
+    results = [[] for _ in uploaded_face_encodings]
+    positions = []
+    queries = []
+    for position, face_encoding in enumerate(uploaded_face_encodings):
+        if not face_encoding:
+            continue
+        encoding = _decode_face_encoding(face_encoding)
+        if encoding is None or encoding.shape != (gallery_index.dim,):
+            continue
+        positions.append(position)
+        queries.append(encoding)
 
-        #进行比较
-        # compare_faces 返回一个布尔值列表，表示 known_face_encodings中的每个编码是否与 uploaded_encoding 匹配
-        matches = face_recognition.compare_faces(known_face_encodings, uploaded_encoding, tolerance=0.6) # tolerance可以调整
+    if not queries:
+        return results
+    if len(gallery_index) == 0:
+        print("人脸库索引为空，没有用户可供比对。")
+        return results
 
-        for i, match in enumerate(matches):
-            if match:
-                matched_user_id = user_ids_ordered[i]
-                print(f"人脸匹配成功: 上传的人脸与用户ID {matched_user_id} 匹配。")
-                return matched_user_id
-        
-        print("未找到匹配的人脸。")
-        return None
+    with metrics.timed('match'):
+        nearest_list = gallery_index.search_batch(np.stack(queries), k=k)
+    for position, nearest in zip(positions, nearest_list):
+        results[position] = nearest
+    return results
+
+def assign_unique_identities(nearest_list, tolerance=0.6):
+    """
+    为多张人脸分配互不重复的身份：按距离从小到大贪心分配，同一用户只分配给距离最近的那张人脸。
+    Args:
+        nearest_list (list[list[tuple[str, float]]]): identify_faces_batch 的返回值 (每张人脸的候选列表)。
+        tolerance (float): 判定为同一人的最大欧氏距离。
+    Returns:
+        list[tuple[str, float] | None]: 与输入顺序一致，未匹配或身份已被其他人脸占用时为 None。
+    """
+    pairs = [
+        (distance, position, user_id)
+        for position, nearest in enumerate(nearest_list)
+        for user_id, distance in nearest
+        if distance <= tolerance
+    ]
+    pairs.sort()
+    assigned = [None] * len(nearest_list)
+    used_user_ids = set()
+    for distance, position, user_id in pairs:
+        if assigned[position] is None and user_id not in used_user_ids:
+            assigned[position] = (user_id, distance)
+            used_user_ids.add(user_id)
+    matched = len(used_user_ids)
+    metrics.MATCH_TOTAL.inc(matched, result='match')
+    metrics.MATCH_TOTAL.inc(len(assigned) - matched, result='no_match')
+    return assigned
+
+def match_face(uploaded_face_encoding, tolerance=0.6):
+    """
+    将上传照片提取的特征编码与人脸库索引进行比对，返回距离最近且在阈值内的用户及其距离。
+    用户有多个样本时，距离按 FACE_SAMPLE_AGGREGATION 取所有样本中的最小距离或到样本均值的距离。
+    Returns:
+        (str, float): 匹配到的用户ID及距离，如果未匹配到则返回 (None, None)。
+    """
+    nearest = identify_face(uploaded_face_encoding, k=1)
+    if nearest:
+        matched_user_id, distance = nearest[0]
+        if distance <= tolerance:
+            metrics.MATCH_TOTAL.inc(result='match')
+            print(f"人脸匹配成功: 上传的人脸与用户ID {matched_user_id} 匹配, 距离 {distance:.4f}。")
+            return matched_user_id, distance
+
+    metrics.MATCH_TOTAL.inc(result='no_match')
+    print("未找到匹配的人脸。")
+    return None, None
+
+def compare_stored_faces(uploaded_face_encoding, tolerance=0.6):
+    """
+    将上传照片提取的特征编码与人脸库索引进行比对，返回距离最近且在阈值内的用户。
+    Args:
+        uploaded_face_encoding (bytes): 二进制表示的待比对人脸编码。
+        tolerance (float): 判定为同一人的最大欧氏距离。
+    Returns:
+        str: 匹配到的用户ID，如果未匹配到则返回 None。
+    """
+    return match_face(uploaded_face_encoding, tolerance=tolerance)[0]
 
+def rebuild_gallery_index(aggregation=None):
+    """从数据库加载所有用户的人脸编码 (注册样本及 face_encodings 表中的其他样本)，整体重建进程内的人脸库索引。
+    在 create_app 时调用一次，之后由 add_user / add_face_sample / delete_user_by_id 等增量维护。
+    Args:
+        aggregation (str): 多样本的聚合方式 'min' 或 'centroid' (FACE_SAMPLE_AGGREGATION)，None 表示沿用索引当前的设置。
+    Returns:
+        int: 索引中的用户数量。
+    """
+    started = time.perf_counter()
+    try:
+        rows = db.session.query(User.id, User.name, User.face_encoding, User.face_data).all()
+        sample_rows = db.session.query(FaceEncoding.id, FaceEncoding.user_id, FaceEncoding.encoding) \
+            .order_by(FaceEncoding.id).all()
     except SQLAlchemyError as e:
-        print(f"数据库查询错误 (compare_stored_faces): {e}")
-        return None
-    except Exception as e:
-        print(f"在 compare_stored_faces 中发生意外错误: {e}")
-        return None
+        db.session.rollback()
+        print(f"数据库查询错误 (rebuild_gallery_index): {e}")
+        return 0
 
-def add_user(name, face_data_json, photo_filename): # face_data 现在是 JSON string
-    if not face_data_json: # 如果提取编码失败，不应添加用户
+    user_ids = []
+    metadata = [] # 用户姓名随编码一起放入索引，签到时不必再查询用户表
+    blobs = []
+    for user_id, name, face_encoding, face_data in rows:
+        if face_encoding is not None:
+            if len(face_encoding) != FACE_ENCODING_BYTES:
+                print(f"用户 {user_id} 的面部数据长度不正确，跳过此用户。")
+                continue
+            blobs.append(bytes(face_encoding))
+        elif face_data:
+            # 尚未迁移的旧数据: 解析 JSON 后转换为二进制格式
+            legacy_encoding = _decode_face_encoding(face_data)
+            if legacy_encoding is None or legacy_encoding.shape != (gallery_index.dim,):
+                print(f"解析用户 {user_id} 的存储面部数据时出错，跳过此用户。")
+                continue # 跳过这个损坏的数据
+            blobs.append(encoding_to_bytes(legacy_encoding))
+        else:
+            print(f"用户 {user_id} 没有面部数据，跳过此用户。")
+            continue
+        user_ids.append(user_id)
+        metadata.append({'name': name})
+
+    # 其他样本的样本键为 "用户ID#样本ID"，注册样本的样本键就是用户ID
+    sample_keys = list(user_ids)
+    names = dict(zip(user_ids, metadata))
+    for sample_id, user_id, encoding in sample_rows:
+        if user_id not in names or len(encoding) != FACE_ENCODING_BYTES:
+            continue # 注册样本无效的用户不参与比对
+        user_ids.append(user_id)
+        sample_keys.append(_sample_key(user_id, sample_id))
+        metadata.append(names[user_id])
+        blobs.append(bytes(encoding))
+
+    # 拼接后一次性零拷贝解码为 (N, 128) 的 float32 矩阵
+    encodings = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(-1, gallery_index.dim)
+    gallery_index.build(user_ids, encodings, metadata, sample_keys=sample_keys, aggregation=aggregation)
+    metrics.observe_stage('gallery_load', time.perf_counter() - started)
+    print(f"人脸库索引已构建，共 {gallery_index.user_count} 个用户，{len(blobs)} 个人脸样本 ({gallery_index.aggregation})。")
+    return gallery_index.user_count
+
+def _create_ann_backend(config):
+    """(Internal) 根据配置创建 ANN 后端对象 (未训练)。"""
+    return IVFPQIndex(
+        gallery_index.dim,
+        nlist=config.get('FACE_INDEX_NLIST'),
+        m=config.get('FACE_INDEX_PQ_M', 8),
+        nprobe=config.get('FACE_INDEX_NPROBE', 16),
+        rerank=config.get('FACE_INDEX_RERANK', 64),
+    )
+
+def setup_gallery_ann(config, force_train=False):
+    """
+    按配置为人脸库索引启用近似最近邻后端 (在 rebuild_gallery_index 之后调用)。
+    FACE_INDEX_BACKEND 为 'flat' 时使用暴力检索；为 'ivfpq' 时优先加载 FACE_INDEX_PATH 处的索引文件，
+    文件不存在 (或 force_train=True) 且人脸库规模达到 FACE_INDEX_MIN_TRAIN 时重新训练并保存。
+    Returns:
+        bool: ANN 后端是否已启用。
+    """
+    backend = config.get('FACE_INDEX_BACKEND', 'flat')
+    if backend == 'flat':
+        gallery_index.set_ann(None)
+        return False
+    if backend != 'ivfpq':
+        print(f"未知的人脸索引后端 {backend}，将使用暴力检索。")
+        gallery_index.set_ann(None)
+        return False
+
+    index_path = config.get('FACE_INDEX_PATH')
+    if index_path and os.path.exists(index_path) and not force_train:
+        try:
+            reused, encoded = gallery_index.load_ann(_create_ann_backend(config), index_path)
+            print(f"已加载 ANN 索引文件 {index_path}: 复用 {reused} 个编码，新编码 {encoded} 个。")
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"加载 ANN 索引文件失败，将重新训练: {e}")
+
+    min_train = config.get('FACE_INDEX_MIN_TRAIN', 10000)
+    if len(gallery_index) < min_train and not force_train: # 按索引行数 (min 模式下为样本数) 判断
+        print(f"人脸库规模 ({len(gallery_index)}) 小于 {min_train}，暂不启用 ANN，使用暴力检索。")
+        gallery_index.set_ann(None)
+        return False
+
+    try:
+        gallery_index.train_ann(_create_ann_backend(config))
+    except ValueError as e:
+        print(f"训练 ANN 索引失败，将使用暴力检索: {e}")
+        gallery_index.set_ann(None)
+        return False
+    print(f"ANN 索引训练完成: {gallery_index.ann.nlist} 个簇, nprobe={gallery_index.ann.nprobe}。")
+    if index_path:
+        try:
+            gallery_index.save_ann(index_path)
+            print(f"ANN 索引已保存到: {index_path}")
+        except OSError as e:
+            print(f"保存 ANN 索引文件失败: {e}")
+    return True
+
+def add_user(name, face_encoding, photo_filename): # face_encoding 是 512 字节的二进制编码
+    if not face_encoding: # 如果提取编码失败，不应添加用户
         print(f"尝试添加用户 {name} 失败，因为人脸数据为空。")
         return None, None
         
-    new_user_instance = User(name=name, face_data=face_data_json, photo_filename=photo_filename)
+    new_user_instance = User(name=name, face_encoding=face_encoding, photo_filename=photo_filename)
     try:
-        db.session.add(new_user_instance)
-        db.session.commit()
-        print(f"用户 {name} 已添加到数据库, ID: {new_user_instance.id}, FaceDataStored: {'Yes' if face_data_json else 'No'}")
+        with metrics.timed('db_write'):
+            db.session.add(new_user_instance)
+            db.session.commit()
+        print(f"用户 {name} 已添加到数据库, ID: {new_user_instance.id}, FaceDataStored: {'Yes' if face_encoding else 'No'}")
+        try:
+            gallery_index.add(new_user_instance.id, bytes_to_encoding(face_encoding), {'name': name}) # 增量更新人脸库索引，无需重建
+        except ValueError as e:
+            print(f"将用户 {new_user_instance.id} 加入人脸库索引失败: {e}")
         return new_user_instance.id, new_user_instance.name
     except SQLAlchemyError as e:
         db.session.rollback()
         print(f"添加用户到数据库失败: {e}")
         return None, None
 
+def add_users_bulk(users):
+    """
+    批量添加用户：一次批量插入、一次提交，成功后增量加入人脸库索引。
+    Args:
+        users (list[dict]): 每项包含 name, face_encoding (512 字节二进制编码), photo_filename。
+    Returns:
+        list[str]: 与输入顺序一致的新用户ID列表，失败时返回 None。
+    """
+    if not users:
+        return []
+
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            'id': generate_uuid(),
+            'name': user['name'],
+            'face_encoding': user['face_encoding'],
+            'photo_filename': user['photo_filename'],
+            'created_at': created_at,
+        } for user in users
+    ]
+    try:
+        db.session.bulk_insert_mappings(User, rows)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"批量添加用户到数据库失败: {e}")
+        return None
+
+    for row in rows:
+        try:
+            gallery_index.add(row['id'], bytes_to_encoding(row['face_encoding']), {'name': row['name']})
+        except ValueError as e:
+            print(f"将用户 {row['id']} 加入人脸库索引失败: {e}")
+    return [row['id'] for row in rows]
+
 def find_user_by_id(user_id):
     try:
         return User.query.get(user_id)
@@ -165,23 +427,47 @@ def find_user_by_id(user_id):
         print(f"查询用户失败 (ID: {user_id}): {e}")
         return None
 
+def find_users_by_ids(user_ids):
+    """批量查询用户，返回 {user_id: User} 字典 (一次查询)。"""
+    if not user_ids:
+        return {}
+    try:
+        users = User.query.filter(User.id.in_(list(user_ids))).all()
+        return {user.id: user for user in users}
+    except SQLAlchemyError as e:
+        print(f"批量查询用户失败: {e}")
+        return {}
+
+def get_user_names(user_ids):
+    """
+    返回 {user_id: name}。优先从人脸库索引的元数据读取 (不访问数据库)，
+    只有不在索引中的用户才回退到一次批量查询；数据库中也不存在的用户不在结果中。
+    """
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        metadata = gallery_index.get_metadata(user_id)
+        if metadata is not None:
+            names[user_id] = metadata['name']
+        else:
+            missing.append(user_id)
+    if missing:
+        names.update({user_id: user.name for user_id, user in find_users_by_ids(missing).items()})
+    return names
+
 def delete_user_by_id(user_id, upload_folder):
     user_to_delete = find_user_by_id(user_id)
     if user_to_delete:
-        photo_path = None
-        if user_to_delete.photo_filename:
-            photo_path = os.path.join(upload_folder, user_to_delete.photo_filename)
+        photo_filenames = [user_to_delete.photo_filename] + [sample.photo_filename for sample in user_to_delete.face_samples]
         
         try:
-            db.session.delete(user_to_delete) # Associated AttendanceRecords will be handled by cascade
+            db.session.delete(user_to_delete) # Associated AttendanceRecords / FaceEncodings will be handled by cascade
             db.session.commit()
             print(f"用户 (ID: {user_id}) 已从数据库删除。")
-            if photo_path and os.path.exists(photo_path):
-                try:
-                    os.remove(photo_path)
-                    print(f"已删除照片文件: {photo_path}")
-                except OSError as e_os:
-                    print(f"删除照片文件失败: {photo_path}, 错误: {e_os}")
+            gallery_index.remove(user_id) # 同步从人脸库索引中移除
+            for photo_filename in photo_filenames:
+                if photo_filename:
+                    photo_store.delete_photo(upload_folder, photo_filename)
             return True
         except SQLAlchemyError as e_db:
             db.session.rollback()
@@ -189,47 +475,485 @@ def delete_user_by_id(user_id, upload_folder):
             return False
     return False
 
+# --- 多人脸样本 ---
+
+_adaptive_lock = threading.Lock()
+_adaptive_updated_at = {} # user_id -> 最近一次自动加入样本的时间 (time.monotonic())，按进程限制自动更新的频率
+
+def _sample_key(user_id, sample_id):
+    """(Internal) face_encodings 表中样本在人脸库索引中的样本键。"""
+    return f"{user_id}#{sample_id}"
+
+def _format_face_sample(sample):
+    return {
+        'sample_id': sample.id,
+        'source': sample.source,
+        'photo_filename': sample.photo_filename,
+        'created_at': sample.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def collect_user_samples(session, user_id):
+    """
+    在给定会话中读取用户的全部人脸样本 (注册样本在前)，用于更新人脸库索引。
+    Returns:
+        (str, list[str], list[np.ndarray]): 姓名、样本键、编码；用户不存在或注册样本无效时返回 None。
+    """
+    user = session.get(User, user_id)
+    if user is None:
+        return None
+    encoding = _decode_face_encoding(user.face_encoding if user.face_encoding is not None else user.face_data)
+    if encoding is None or encoding.shape != (gallery_index.dim,):
+        return None
+    keys = [user_id]
+    encodings = [encoding]
+    samples = session.query(FaceEncoding.id, FaceEncoding.encoding) \
+        .filter(FaceEncoding.user_id == user_id).order_by(FaceEncoding.id).all()
+    for sample_id, sample_encoding in samples:
+        keys.append(_sample_key(user_id, sample_id))
+        encodings.append(bytes_to_encoding(sample_encoding))
+    return user.name, keys, encodings
+
+def write_face_sample(session, user_id, face_encoding, source, photo_filename, max_samples, max_adaptive):
+    """
+    在给定会话中为用户加入一个人脸样本 (不提交)。ASGI 模式通过 AsyncSession.run_sync 复用此函数。
+    样本数 (含注册样本) 达到 max_samples，或自动样本数达到 max_adaptive 时，替换最早的自动样本；
+    没有可替换的自动样本时不加入。
+    Returns:
+        (FaceEncoding, tuple): 新样本及 collect_user_samples 的结果；用户不存在或样本已满时返回 (None, None)。
+    """
+    if session.get(User, user_id) is None:
+        return None, None
+    samples = session.query(FaceEncoding).filter(FaceEncoding.user_id == user_id).order_by(FaceEncoding.id).all()
+    adaptive = [sample for sample in samples if sample.source == 'adaptive']
+    if 1 + len(samples) >= max_samples or (source == 'adaptive' and len(adaptive) >= max_adaptive):
+        if not adaptive:
+            return None, None
+        session.delete(adaptive[0]) # 自动样本不保存照片，直接删除
+    sample = FaceEncoding(user_id=user_id, encoding=face_encoding, source=source, photo_filename=photo_filename,
+                          created_at=datetime.utcnow())
+    session.add(sample)
+    session.flush()
+    return sample, collect_user_samples(session, user_id)
+
+def refresh_user_samples(user_id, collected):
+    """用 collect_user_samples 的结果替换用户在人脸库索引中的样本 (在事务提交后调用)。"""
+    if collected is None:
+        gallery_index.remove(user_id)
+        return
+    name, keys, encodings = collected
+    try:
+        gallery_index.set_user_samples(user_id, keys, encodings, {'name': name})
+    except ValueError as e:
+        print(f"更新用户 {user_id} 的人脸库索引失败: {e}")
+
+def get_face_samples(user_id):
+    """返回用户在 face_encodings 表中的人脸样本 (不含注册样本)，按加入顺序排列；查询失败时返回 None。"""
+    try:
+        samples = FaceEncoding.query.filter_by(user_id=user_id).order_by(FaceEncoding.id).all()
+        return [_format_face_sample(sample) for sample in samples]
+    except SQLAlchemyError as e:
+        print(f"查询用户人脸样本失败 (ID: {user_id}): {e}")
+        return None
+
+def add_face_sample(user_id, face_encoding, photo_filename=None, source='manual', max_samples=10, max_adaptive=3):
+    """
+    为已注册用户加入一个人脸样本 (例如不同光线、角度下的照片)，并增量更新人脸库索引。
+    Returns:
+        dict: 新样本的信息；用户不存在、样本已满或写入数据库失败时返回 None。
+    """
+    if not face_encoding:
+        print(f"尝试为用户 {user_id} 添加人脸样本失败，因为人脸数据为空。")
+        return None
+    try:
+        with metrics.timed('db_write'):
+            sample, collected = write_face_sample(db.session, user_id, face_encoding, source, photo_filename,
+                                                  max_samples, max_adaptive)
+            if sample is None:
+                db.session.rollback()
+                print(f"为用户 {user_id} 添加人脸样本失败: 用户不存在或样本数已达上限。")
+                return None
+            db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"添加人脸样本到数据库失败: {e}")
+        return None
+    refresh_user_samples(user_id, collected)
+    print(f"用户 {user_id} 新增人脸样本 {sample.id} ({source})。")
+    return _format_face_sample(sample)
+
+def delete_face_sample(user_id, sample_id, upload_folder):
+    """删除用户的一个人脸样本 (及其照片)，并同步更新人脸库索引。成功返回 True。"""
+    try:
+        sample = FaceEncoding.query.filter_by(id=sample_id, user_id=user_id).first()
+        if sample is None:
+            return False
+        photo_filename = sample.photo_filename
+        db.session.delete(sample)
+        db.session.flush()
+        collected = collect_user_samples(db.session, user_id)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"删除人脸样本失败 (ID: {sample_id}): {e}")
+        return False
+    refresh_user_samples(user_id, collected)
+    if photo_filename:
+        photo_store.delete_photo(upload_folder, photo_filename)
+    return True
+
+def should_adapt_sample(user_id, distance, config):
+    """
+    判断一次签到是否应把签到照片的编码自动加入为用户的新样本：
+    需要开启 FACE_ADAPTIVE_UPDATE，距离在 [FACE_ADAPTIVE_MIN_DISTANCE, FACE_ADAPTIVE_MAX_DISTANCE] 内
+    (足够可信，又与已有样本有差别)，且距该用户上次自动更新超过 FACE_ADAPTIVE_INTERVAL_SECONDS。
+    返回 True 时同时记录本次更新时间。
+    """
+    if not config.get('FACE_ADAPTIVE_UPDATE', False) or distance is None:
+        return False
+    if not config.get('FACE_ADAPTIVE_MIN_DISTANCE', 0.25) <= distance <= config.get('FACE_ADAPTIVE_MAX_DISTANCE', 0.4):
+        return False
+    now = time.monotonic()
+    with _adaptive_lock:
+        last = _adaptive_updated_at.get(user_id)
+        if last is not None and now - last < config.get('FACE_ADAPTIVE_INTERVAL_SECONDS', 86400):
+            return False
+        _adaptive_updated_at[user_id] = now
+    return True
+
+def apply_adaptive_sample(user_id, face_encoding, distance, config):
+    """高置信度签到后按 should_adapt_sample 的条件把签到编码加入为自动样本，返回新样本信息或 None。"""
+    if not should_adapt_sample(user_id, distance, config):
+        return None
+    return add_face_sample(user_id, face_encoding, source='adaptive',
+                           max_samples=config.get('FACE_MAX_SAMPLES_PER_USER', 10),
+                           max_adaptive=config.get('FACE_ADAPTIVE_MAX_SAMPLES', 3))
+
+def write_attendance(session, user_ids, timestamp):
+    """在给定会话中插入签到记录并累加日汇总 (不提交)。ASGI 模式通过 AsyncSession.run_sync 复用此函数。"""
+    session.bulk_insert_mappings(
+        AttendanceRecord,
+        [{'user_id': user_id, 'timestamp': timestamp} for user_id in user_ids]
+    )
+    attendance_rollup.increment_daily_summaries(user_ids, timestamp, session=session)
+
+def _commit_attendance(user_ids, timestamp):
+    """(Internal) 在同一事务中插入签到记录并累加日汇总，然后提交。
+
+    两个请求同时为同一用户插入当天第一条汇总行时，后提交的一方会遇到主键冲突，
+    此时回滚并重试一次 (重试时 UPDATE 能命中已存在的汇总行)。
+    """
+    for attempt in range(2):
+        try:
+            with metrics.timed('db_write'):
+                write_attendance(db.session, user_ids, timestamp)
+                db.session.commit()
+            return
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 1:
+                raise
+
 def add_attendance_record(user_id, user_name=None): # user_name is not strictly needed if fetching from User table
-    user = find_user_by_id(user_id)
-    if not user:
+    if user_id not in get_user_names([user_id]):
         print(f"添加签到记录失败：未找到用户ID {user_id}")
         return None
 
-    new_record = AttendanceRecord(user_id=user_id, timestamp=datetime.utcnow())
+    timestamp = datetime.utcnow()
     try:
-        db.session.add(new_record)
-        db.session.commit()
-        print(f"为用户ID {user_id} 添加了签到记录, 时间: {new_record.timestamp}")
-        return new_record.timestamp
+        _commit_attendance([user_id], timestamp)
+        print(f"为用户ID {user_id} 添加了签到记录, 时间: {timestamp}")
+        return timestamp
     except SQLAlchemyError as e:
         db.session.rollback()
         print(f"添加签到记录到数据库失败: {e}")
         return None
 
+def add_attendance_records_bulk(user_ids):
+    """
+    批量添加签到记录：一次批量插入、一次提交 (同时累加日汇总)。
+    Args:
+        user_ids (list[str]): 签到用户ID列表 (由人脸库索引匹配得到，不再逐个查询用户是否存在)。
+    Returns:
+        datetime: 本批记录的签到时间，失败时返回 None。
+    """
+    if not user_ids:
+        return None
+
+    timestamp = datetime.utcnow()
+    try:
+        _commit_attendance(user_ids, timestamp)
+        print(f"批量添加了 {len(user_ids)} 条签到记录, 时间: {timestamp}")
+        return timestamp
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"批量添加签到记录到数据库失败: {e}")
+        return None
+
+def check_recent_signins(user_ids):
+    """
+    签到去抖的只读检查 (不访问数据库)。
+    Returns:
+        (dict, list): 窗口内已签到用户的结果 {user_id: {'name', 'timestamp', 'duplicate': True}}，
+                      以及需要继续处理的用户ID列表 (已去重)。
+    """
+    results = {}
+    fresh_user_ids = []
+    for user_id in dict.fromkeys(user_ids):
+        existing = signin_debouncer.check(user_id) # 窗口内的重复签到: 不访问数据库
+        if existing is not None:
+            results[user_id] = {**existing, 'duplicate': True}
+        else:
+            fresh_user_ids.append(user_id)
+    return results, fresh_user_ids
+
+def claim_signins(user_ids, names, timestamp, results):
+    """
+    为用户占用本次签到并把结果写入 results。names 中没有的用户 (数据库中不存在) 被跳过。
+    Returns:
+        list[str]: 占用成功、需要写入签到记录的用户ID。写入失败时调用方应对它们调用 signin_debouncer.release。
+    """
+    claimed_user_ids = []
+    for user_id in user_ids:
+        name = names.get(user_id)
+        if name is None:
+            print(f"添加签到记录失败：未找到用户ID {user_id}")
+            continue
+        existing = signin_debouncer.claim(user_id, name, timestamp) # 并发的重复请求只有一个能占用成功
+        if existing is not None:
+            results[user_id] = {**existing, 'duplicate': True}
+            continue
+        claimed_user_ids.append(user_id)
+        results[user_id] = {'name': name, 'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S"), 'duplicate': False}
+    return claimed_user_ids
+
+def record_attendance(user_ids):
+    """
+    为匹配到的用户记录签到 (签到接口统一使用)，在去抖窗口内重复签到的用户不写数据库。
+    Args:
+        user_ids (list[str]): 匹配到的用户ID列表 (重复的ID只处理一次)。
+    Returns:
+        dict: {user_id: {'name', 'timestamp', 'duplicate'}}，duplicate 为 True 表示返回的是窗口内已有的签到；
+              数据库中不存在的用户不在结果中。写入数据库失败时返回 None。
+    """
+    results, fresh_user_ids = check_recent_signins(user_ids)
+    if not fresh_user_ids:
+        return results
+
+    names = get_user_names(fresh_user_ids) # 匹配到的用户都在人脸库索引中，通常不访问数据库
+    timestamp = datetime.utcnow()
+    claimed_user_ids = claim_signins(fresh_user_ids, names, timestamp, results)
+
+    if claimed_user_ids:
+        try:
+            _commit_attendance(claimed_user_ids, timestamp)
+            print(f"添加了 {len(claimed_user_ids)} 条签到记录, 时间: {timestamp}")
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            for user_id in claimed_user_ids:
+                signin_debouncer.release(user_id) # 写入失败时撤销占用，允许客户端立即重试
+            print(f"添加签到记录到数据库失败: {e}")
+            return None
+    return results
+
 def get_all_attendance_records():
     try:
-        records_with_user = db.session.query(
-                AttendanceRecord.id, 
-                AttendanceRecord.user_id, 
-                User.name.label('user_name'), 
-                AttendanceRecord.timestamp
-            ).join(User, AttendanceRecord.user_id == User.id)\
-             .order_by(AttendanceRecord.timestamp.desc())\
-             .all()
-        
-        formatted_records = [
-            {
-                'id': rec.id,
-                'user_id': rec.user_id,
-                'name': rec.user_name,
-                'timestamp': rec.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            } for rec in records_with_user
-        ]
-        return formatted_records
+        records_with_user = _attendance_records_query().all()
+        return [_format_attendance_record(rec) for rec in records_with_user]
     except SQLAlchemyError as e:
         print(f"获取所有签到记录失败: {e}")
         return []
 
+def _attendance_records_query(start=None, end=None, user_id=None):
+    """(Internal) 签到记录查询 (关联用户姓名)，按时间倒序、ID 倒序排列。start 包含，end 不包含。"""
+    query = db.session.query(
+            AttendanceRecord.id,
+            AttendanceRecord.user_id,
+            User.name.label('user_name'),
+            AttendanceRecord.timestamp
+        ).join(User, AttendanceRecord.user_id == User.id)
+    if start is not None:
+        query = query.filter(AttendanceRecord.timestamp >= start)
+    if end is not None:
+        query = query.filter(AttendanceRecord.timestamp < end)
+    if user_id is not None:
+        query = query.filter(AttendanceRecord.user_id == user_id)
+    return query.order_by(AttendanceRecord.timestamp.desc(), AttendanceRecord.id.desc())
+
+def _format_attendance_record(rec):
+    return {
+        'id': rec.id,
+        'user_id': rec.user_id,
+        'name': rec.user_name,
+        'timestamp': rec.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def encode_records_cursor(timestamp, record_id):
+    """把分页位置 (最后一条记录的时间和ID) 编码为不透明的游标字符串。"""
+    raw = f"{timestamp.isoformat()}|{record_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_records_cursor(cursor):
+    """解析游标字符串，返回 (timestamp, record_id)。格式不正确时抛出 ValueError。"""
+    try:
+        timestamp, record_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(record_id)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+def get_attendance_records_page(limit=100, cursor=None, start=None, end=None, user_id=None):
+    """
+    按键集 (keyset) 分页查询签到记录：每页从上一页最后一条记录之后继续，不使用 OFFSET，翻到任何位置耗时都相同。
+    Args:
+        limit (int): 每页记录数。
+        cursor (str): 上一页返回的 next_cursor，None 表示第一页。
+        start, end (datetime): 时间范围，start 包含，end 不包含。
+        user_id (str): 只查询指定用户的记录。
+    Returns:
+        (list[dict], str | None): 当前页的记录和下一页的游标 (没有下一页时为 None)。
+    Raises:
+        ValueError: 游标格式不正确。
+    """
+    query = _attendance_records_query(start, end, user_id)
+    if cursor:
+        cursor_timestamp, cursor_id = decode_records_cursor(cursor)
+        query = query.filter(or_(
+            AttendanceRecord.timestamp < cursor_timestamp,
+            and_(AttendanceRecord.timestamp == cursor_timestamp, AttendanceRecord.id < cursor_id)
+        ))
+    try:
+        rows = query.limit(limit + 1).all() # 多取一条用于判断是否还有下一页
+    except SQLAlchemyError as e:
+        print(f"分页获取签到记录失败: {e}")
+        return [], None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_records_cursor(rows[-1].timestamp, rows[-1].id)
+    return [_format_attendance_record(rec) for rec in rows], next_cursor
+
+def iter_attendance_records(start=None, end=None, user_id=None, batch_size=1000):
+    """
+    流式遍历签到记录 (用于导出)：使用服务端游标和 yield_per 分批读取，不会把全部记录加载到内存。
+    """
+    query = _attendance_records_query(start, end, user_id)\
+        .execution_options(stream_results=True)\
+        .yield_per(batch_size)
+    for rec in query:
+        yield _format_attendance_record(rec)
+
+def get_attendance_stats(group_by, start_day=None, end_day=None, user_id=None):
+    """
+    从签到日汇总表读取统计数据。
+    Args:
+        group_by (str): 'day' 按天统计，'user' 按用户统计。
+        start_day, end_day (date): 日期范围 (UTC，包含两端)。
+        user_id (str): 只统计指定用户。
+    Returns:
+        list[dict]: 统计结果，出错时返回 None。
+    """
+    try:
+        if group_by == 'user':
+            return attendance_rollup.get_user_stats(start_day, end_day, user_id)
+        return attendance_rollup.get_daily_stats(start_day, end_day, user_id)
+    except SQLAlchemyError as e:
+        print(f"获取签到统计失败: {e}")
+        return None
+
+def migrate_legacy_face_data(batch_size=500, keep_json=False):
+    """
+    将旧格式 (face_data 列中的 JSON 文本) 的人脸编码回填到二进制 face_encoding 列。
+    按主键分批处理，每批提交一次，可以中断后重复执行。
+    Args:
+        batch_size (int): 每批处理的用户数量。
+        keep_json (bool): 为 True 时保留旧的 JSON 列内容，否则回填后清空以节省空间。
+    Returns:
+        (int, int): (成功迁移的用户数, 解析失败被跳过的用户数)。
+    """
+    migrated = 0
+    skipped = 0
+    last_id = ''
+    while True:
+        rows = db.session.query(User.id, User.face_data)\
+            .filter(User.face_encoding.is_(None), User.face_data.isnot(None), User.id > last_id)\
+            .order_by(User.id)\
+            .limit(batch_size)\
+            .all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for user_id, face_data in rows:
+            encoding = _decode_face_encoding(face_data)
+            if encoding is None or encoding.shape != (gallery_index.dim,):
+                print(f"用户 {user_id} 的旧面部数据无法解析，跳过。")
+                skipped += 1
+                continue
+            update = {'id': user_id, 'face_encoding': encoding_to_bytes(encoding)}
+            if not keep_json:
+                update['face_data'] = None
+            updates.append(update)
+
+        try:
+            db.session.bulk_update_mappings(User, updates)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"迁移人脸数据失败 (批次截止ID {last_id}): {e}")
+            raise
+        migrated += len(updates)
+        print(f"已迁移 {migrated} 个用户的人脸数据...")
+    return migrated, skipped
+
+def encode_users_cursor(created_at, user_id):
+    """把用户列表的分页位置 (最后一个用户的注册时间和ID) 编码为不透明的游标字符串。"""
+    raw = f"{created_at.isoformat()}|{user_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_users_cursor(cursor):
+    """解析用户列表的游标字符串，返回 (created_at, user_id)。格式不正确时抛出 ValueError。"""
+    try:
+        created_at, user_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), user_id
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+def get_users_page(limit=100, cursor=None):
+    """
+    按注册时间倒序键集分页查询用户摘要 (只查询 ID、姓名、照片文件名和注册时间，不读取人脸编码)。
+    Returns:
+        (list[dict], str | None): 当前页的用户和下一页的游标 (没有下一页时为 None)。
+    Raises:
+        ValueError: 游标格式不正确。
+    """
+    query = db.session.query(User.id, User.name, User.photo_filename, User.created_at)
+    if cursor:
+        cursor_created_at, cursor_id = decode_users_cursor(cursor)
+        query = query.filter(or_(
+            User.created_at < cursor_created_at,
+            and_(User.created_at == cursor_created_at, User.id < cursor_id)
+        ))
+    try:
+        rows = query.order_by(User.created_at.desc(), User.id.desc()).limit(limit + 1).all()
+    except SQLAlchemyError as e:
+        print(f"分页获取用户列表失败: {e}")
+        return [], None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_users_cursor(rows[-1].created_at, rows[-1].id)
+    users = [
+        {
+            'id': row.id,
+            'name': row.name,
+            'photo_filename': row.photo_filename,
+            'created_at': row.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        } for row in rows
+    ]
+    return users, next_cursor
+
 def get_all_users_summary():
     try:
         users = User.query.all()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+class EncodingCache:
+    """以图片内容哈希为键的人脸编码缓存，位于 EncoderPool 之前。
+
+    - 内存层: 容量为 max_entries 的 LRU，条目超过 ttl 秒后失效。
+    - 磁盘层 (可选): 每个条目一个 JSON 文件，进程重启后仍可命中，同样受 ttl 限制。
+    - 键同时包含预处理/检测参数，修改配置后不会命中旧结果。
+    只缓存成功的结果 (包括"没有检测到人脸")，解码失败等错误不缓存。
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (过期时间, faces)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or bool(self.disk_dir)
+
+    @staticmethod
+    def make_key(image_bytes, options):
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """返回缓存的 faces 列表，未命中时返回 None。"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        faces = self._disk_get(key, now)
+        with self._lock:
+            if faces is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._memory_put(key, faces, now) # 提升到内存层
+        return faces
+
+    def put(self, key, faces):
+        if faces is None:
+            return
+        now = time.time()
+        self._memory_put(key, faces, now)
+        self._disk_put(key, faces, now)
+
+    def _memory_put(self, key, faces, now):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (now + self.ttl, faces)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False) # 淘汰最久未使用的条目
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"读取编码缓存文件失败 {path}: {e}")
+            return None
+        if data.get('created', 0) + self.ttl <= now:
+            try:
+                os.remove(path) # 过期条目惰性删除
+            except OSError:
+                pass
+            return None
+        return [
+            {'encoding': base64.b64decode(face['encoding']), 'box': tuple(face['box'])}
+            for face in data['faces']
+        ]
+
+    def _disk_put(self, key, faces, now):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        data = {
+            'created': now,
+            'faces': [
+                {'encoding': base64.b64encode(face['encoding']).decode('ascii'), 'box': list(face['box'])}
+                for face in faces
+            ],
+        }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path) # 原子替换，避免其他进程读到写了一半的文件
+        except OSError as e:
+            print(f"写入编码缓存文件失败 {path}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,311 @@
+import io
+import os
+import time
+import atexit
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from PIL import Image
+import face_recognition # 在每个工作进程中导入一次，dlib 模型随之加载并常驻
+
+from face_index import encoding_to_bytes
+from encoding_cache import EncodingCache
+import metrics
+
+class EncoderBusyError(Exception):
+    """编码队列已满 (背压)，调用方应返回 503 让客户端稍后重试。"""
+
+class EncoderTimeoutError(Exception):
+    """单个请求等待编码结果超时。"""
+
+# --- 工作进程中执行的函数 (必须是模块级函数，才能被 pickle 发送到子进程) ---
+
+def init_worker():
+    """工作进程初始化：用一张空白小图预热 dlib 检测器和编码模型，避免第一次请求时才加载。"""
+    blank = np.zeros((32, 32, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    print(f"人脸编码工作进程 {os.getpid()} 已就绪。")
+
+DEFAULT_ENCODE_OPTIONS = {
+    'max_side': 800, # 检测前把图片最长边缩小到该像素数，0 表示不缩放
+    'jpeg_draft': True, # JPEG 使用 draft 模式在解码时直接按 1/2、1/4、1/8 缩小
+    'model': 'hog', # 人脸检测模型: 'hog' (CPU 快) 或 'cnn' (更准，需要 GPU 才快)
+    'upsample': 1, # 检测时的上采样次数，越大越能找到小脸，但越慢
+}
+
+def _decode_image(image_bytes, max_side, jpeg_draft):
+    """(Internal) 解码图片为 RGB 数组。返回 (image, scale_to_original)。
+
+    启用 jpeg_draft 时，JPEG 会在解码阶段直接缩小 (最长边不小于 max_side)，解码耗时随之下降；
+    scale_to_original 为解码结果到原始分辨率的缩放系数，用于把人脸框换算回原图坐标。
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        original_width = img.size[0]
+        if jpeg_draft and max_side and img.format == 'JPEG':
+            img.draft('RGB', (max_side, max_side)) # 只会按 2 的幂缩小，且保证结果不小于请求的尺寸
+        image = np.asarray(img.convert('RGB'))
+    return image, original_width / image.shape[1]
+
+def encode_image_bytes(image_bytes, options=None):
+    """从图片的原始字节中提取所有人脸编码及其位置。
+
+    流程: 解码 (可选 JPEG draft) -> 缩小到 max_side 后检测人脸 -> 人脸框映射回解码图 -> 在解码图上计算编码。
+
+    Returns:
+        dict: {'faces': faces, 'timings': {阶段: 毫秒}}。faces 为每张人脸一项
+              {'encoding': 512 字节的二进制编码, 'box': 原图坐标 (top, right, bottom, left)}，
+              未检测到人脸时为空列表，图片无法解码或发生错误时为 None。
+    """
+    options = {**DEFAULT_ENCODE_OPTIONS, **(options or {})}
+    max_side = options['max_side']
+    timings = {}
+    try:
+        start = time.perf_counter()
+        image, scale_to_original = _decode_image(image_bytes, max_side, options['jpeg_draft'])
+        timings['decode'] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        height, width = image.shape[:2]
+        detect_scale = max_side / max(height, width) if max_side and max(height, width) > max_side else 1.0
+        if detect_scale < 1.0:
+            detect_size = (max(int(round(width * detect_scale)), 1), max(int(round(height * detect_scale)), 1))
+            detect_image = np.asarray(Image.fromarray(image).resize(detect_size, Image.BILINEAR))
+        else:
+            detect_image = image
+        timings['resize'] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        detected = face_recognition.face_locations(
+            detect_image, number_of_times_to_upsample=options['upsample'], model=options['model'])
+        timings['detect'] = (time.perf_counter() - start) * 1000
+
+        # 把小图上的人脸框映射回解码图，编码仍在较高分辨率的图像上进行
+        face_locations = [
+            (
+                max(int(round(top / detect_scale)), 0),
+                min(int(round(right / detect_scale)), width),
+                min(int(round(bottom / detect_scale)), height),
+                max(int(round(left / detect_scale)), 0),
+            ) for top, right, bottom, left in detected
+        ]
+
+        start = time.perf_counter()
+        face_encodings = face_recognition.face_encodings(image, known_face_locations=face_locations)
+        timings['encode'] = (time.perf_counter() - start) * 1000
+
+        # 转换为紧凑的 float32 二进制表示，与数据库 face_encoding 列的存储格式一致
+        faces = [
+            {
+                'encoding': encoding_to_bytes(encoding),
+                'box': tuple(int(round(v * scale_to_original)) for v in location),
+            }
+            for encoding, location in zip(face_encodings, face_locations)
+        ]
+        return {'faces': faces, 'timings': timings}
+    except Exception as e:
+        print(f"提取人脸编码时出错: {e}")
+        return {'faces': None, 'timings': timings}
+
+def encode_image_file(path, options=None):
+    """在工作进程中读取图片文件并提取人脸 (用于批量导入，避免把图片字节在进程间传递)。"""
+    try:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+    except OSError as e:
+        print(f"读取图片文件失败 {path}: {e}")
+        return {'faces': None, 'timings': {}}
+    return encode_image_bytes(image_bytes, options)
+
+# --- Web 进程中使用的编码执行器 ---
+
+class EncoderPool:
+    """人脸编码执行器：把 CPU 密集的 dlib 计算放到独立的工作进程池中执行，不阻塞 Flask 请求线程。
+
+    - 每个工作进程在启动时加载一次 dlib 模型。
+    - 排队+执行中的任务数受 queue_size 限制，超出时立即抛出 EncoderBusyError (背压)。
+    - 每个请求最多等待 timeout 秒，超时抛出 EncoderTimeoutError。
+    - workers 为 0 时在当前线程内直接计算 (便于开发调试)。
+    """
+
+    def __init__(self, workers=0, queue_size=8, timeout=10.0, options=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.configure(workers, queue_size, timeout, options)
+        atexit.register(self.shutdown)
+
+    def configure(self, workers, queue_size, timeout, options=None):
+        self.shutdown()
+        self.workers = workers
+        self.queue_size = max(queue_size, 1)
+        self.timeout = timeout
+        self.options = {**DEFAULT_ENCODE_OPTIONS, **(options or {})} # 预处理/检测参数，随每个任务发送给工作进程
+        self.report_timings = False
+        self.cache = None # 可选的 EncodingCache，命中时跳过解码和 dlib 计算
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+
+    def init_app(self, app):
+        workers = app.config.get('ENCODER_WORKERS', 0)
+        self.configure(
+            workers=workers,
+            queue_size=app.config.get('ENCODER_QUEUE_SIZE', max(workers, 1) * 4),
+            timeout=app.config.get('ENCODER_TIMEOUT', 10.0),
+            options={
+                'max_side': app.config.get('FACE_DETECT_MAX_SIDE', DEFAULT_ENCODE_OPTIONS['max_side']),
+                'jpeg_draft': app.config.get('FACE_JPEG_DRAFT', DEFAULT_ENCODE_OPTIONS['jpeg_draft']),
+                'model': app.config.get('FACE_DETECT_MODEL', DEFAULT_ENCODE_OPTIONS['model']),
+                'upsample': app.config.get('FACE_DETECT_UPSAMPLE', DEFAULT_ENCODE_OPTIONS['upsample']),
+            },
+        )
+        self.report_timings = app.config.get('FACE_REPORT_TIMINGS', False)
+        cache = EncodingCache(
+            max_entries=app.config.get('ENCODING_CACHE_SIZE', 1024),
+            ttl=app.config.get('ENCODING_CACHE_TTL', 3600),
+            disk_dir=app.config.get('ENCODING_CACHE_DIR'),
+        )
+        self.cache = cache if cache.enabled else None
+
+    def _unpack(self, result):
+        """(Internal) 取出工作进程返回的人脸列表，记录各阶段耗时指标，并按需输出。"""
+        for stage, ms in result['timings'].items():
+            metrics.observe_stage(stage, ms / 1000)
+        if self.report_timings:
+            stages = ', '.join(f"{stage} {ms:.1f}ms" for stage, ms in result['timings'].items())
+            print(f"人脸编码各阶段耗时: {stages}")
+        return result['faces']
+
+    def _get_executor(self):
+        # 延迟创建进程池：flask CLI 命令等不做编码的场景不会启动工作进程
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'), # 不 fork 带有线程和数据库连接的 Web 进程
+                    initializer=init_worker,
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        """提交一个任务，返回 Future。队列已满时抛出 EncoderBusyError。"""
+        slots = self._slots # 重新配置后旧任务仍归还到它们占用的信号量
+        if not slots.acquire(blocking=False):
+            raise EncoderBusyError("人脸编码队列已满")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            slots.release()
+            print("人脸编码进程池已损坏，将在下次请求时重建。")
+            self.shutdown()
+            raise EncoderBusyError("人脸编码进程池不可用")
+        except Exception:
+            slots.release()
+            raise
+        # 任务真正结束 (包括调用方已超时放弃的任务) 后才释放名额，保证排队数量有上限
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _wait(self, future, timeout):
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise EncoderTimeoutError(f"人脸编码超过 {self.timeout} 秒未完成")
+        except BrokenProcessPool:
+            self.shutdown()
+            raise EncoderBusyError("人脸编码进程池不可用")
+
+    def _compute(self, image_bytes):
+        """(Internal) 不经过缓存，直接计算一张图片。"""
+        with metrics.timed('encoder_total'):
+            if self.workers <= 0:
+                return self._unpack(encode_image_bytes(image_bytes, self.options))
+            return self._unpack(self._wait(self.submit(encode_image_bytes, image_bytes, self.options), self.timeout))
+
+    def _compute_many(self, image_bytes_list):
+        """(Internal) 不经过缓存，并行计算多张图片：全部提交后统一等待，共享同一个超时时间。"""
+        if self.workers <= 0:
+            return [self._unpack(encode_image_bytes(image_bytes, self.options)) for image_bytes in image_bytes_list]
+        futures = []
+        try:
+            for image_bytes in image_bytes_list:
+                futures.append(self.submit(encode_image_bytes, image_bytes, self.options))
+        except EncoderBusyError:
+            for future in futures:
+                future.cancel()
+            raise
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        results = []
+        try:
+            for future in futures:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                results.append(self._unpack(self._wait(future, remaining)))
+        except (EncoderTimeoutError, EncoderBusyError):
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+
+    def encode(self, image_bytes):
+        """提取一张图片中的所有人脸，返回 encode_image_bytes 结果中的 faces。相同内容的图片直接命中缓存。"""
+        if self.cache is None:
+            return self._compute(image_bytes)
+        key = EncodingCache.make_key(image_bytes, self.options)
+        faces = self.cache.get(key)
+        if faces is None:
+            faces = self._compute(image_bytes)
+            self.cache.put(key, faces)
+        return faces
+
+    async def encode_async(self, image_bytes):
+        """encode 的 asyncio 版本 (ASGI 模式使用)：等待工作进程时不占用事件循环或线程。"""
+        key = None
+        if self.cache is not None:
+            key = EncodingCache.make_key(image_bytes, self.options)
+            faces = self.cache.get(key)
+            if faces is not None:
+                return faces
+
+        started = time.perf_counter()
+        if self.workers <= 0:
+            result = await asyncio.to_thread(encode_image_bytes, image_bytes, self.options)
+        else:
+            future = self.submit(encode_image_bytes, image_bytes, self.options)
+            try:
+                # wait_for 超时会取消包装后的 asyncio future，进而取消尚未开始执行的进程池任务
+                result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            except asyncio.TimeoutError:
+                raise EncoderTimeoutError(f"人脸编码超过 {self.timeout} 秒未完成")
+            except BrokenProcessPool:
+                self.shutdown()
+                raise EncoderBusyError("人脸编码进程池不可用")
+        metrics.observe_stage('encoder_total', time.perf_counter() - started)
+        faces = self._unpack(result)
+        if key is not None:
+            self.cache.put(key, faces)
+        return faces
+
+    def encode_many(self, image_bytes_list):
+        """并行提取多张图片中的人脸，只有未命中缓存的图片才会提交到进程池。"""
+        if self.cache is None:
+            return self._compute_many(image_bytes_list)
+        keys = [EncodingCache.make_key(image_bytes, self.options) for image_bytes in image_bytes_list]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, faces in enumerate(results) if faces is None]
+        if missing:
+            computed = self._compute_many([image_bytes_list[i] for i in missing])
+            for i, faces in zip(missing, computed):
+                results[i] = faces
+                self.cache.put(keys[i], faces)
+        return results
+
+# 进程级单例，在 create_app 时按配置初始化
+encoder_pool = EncoderPool()
@@ -0,0 +1,389 @@
+import threading
+import numpy as np
+
+FACE_ENCODING_DIM = 128 # face_recognition 输出的人脸编码维度
+FACE_ENCODING_DTYPE = np.dtype('<f4') # 存储格式: 小端 float32，每个编码 128 * 4 = 512 字节
+FACE_ENCODING_BYTES = FACE_ENCODING_DIM * FACE_ENCODING_DTYPE.itemsize
+
+def encoding_to_bytes(encoding):
+    """将人脸编码转换为 512 字节的 float32 二进制表示 (用于 User.face_encoding 列)。"""
+    vector = np.asarray(encoding, dtype=FACE_ENCODING_DTYPE).reshape(-1)
+    if vector.shape[0] != FACE_ENCODING_DIM:
+        raise ValueError(f"人脸编码维度应为 {FACE_ENCODING_DIM}，实际为 {vector.shape[0]}")
+    return vector.tobytes()
+
+def bytes_to_encoding(data):
+    """将二进制人脸编码零拷贝解码为只读的 float32 数组。"""
+    if len(data) != FACE_ENCODING_BYTES:
+        raise ValueError(f"人脸编码应为 {FACE_ENCODING_BYTES} 字节，实际为 {len(data)} 字节")
+    return np.frombuffer(data, dtype=FACE_ENCODING_DTYPE)
+
+class FaceIndex:
+    """进程内常驻的人脸库索引。
+
+    所有已注册用户的人脸编码保存在一个连续的 float32 矩阵中,
+    并维护一个与之平行的用户ID数组。比对时只需一次向量化的距离计算,
+    不再需要每次签到都查询数据库并逐个解析 JSON。
+    每个用户还可以附带少量元数据 (例如姓名)，签到时直接从索引读取，不必再查询用户表。
+
+    一个用户可以有多个人脸样本，aggregation 决定样本如何放入索引:
+    - 'min': 每个样本占一行 (行键为样本键)，检索时按用户取最小距离;
+    - 'centroid': 每个用户只占一行 (行键为用户ID)，内容为该用户所有样本的均值，检索开销与单样本相同。
+    """
+
+    def __init__(self, dim=FACE_ENCODING_DIM, initial_capacity=1024, aggregation='min'):
+        self.dim = dim
+        self.aggregation = aggregation
+        self._lock = threading.RLock()
+        self._matrix = np.empty((initial_capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(initial_capacity, dtype=np.float32) # 预先计算的每行平方范数
+        self._user_ids = np.empty(initial_capacity, dtype=object) # 行号 -> 所属用户ID
+        self._keys = np.empty(initial_capacity, dtype=object) # 行号 -> 行键
+        self._positions = {} # 行键 -> 矩阵中的行号
+        self._user_rows = {} # user_id -> 该用户占用的行键集合
+        self._max_rows_per_user = 1 # 单个用户占用行数的上界，检索时据此多取候选以保证得到 k 个不同用户
+        self._metadata = {} # user_id -> 元数据 dict (例如 {'name': ...})
+        self._size = 0
+        self._ann = None # 可选的近似最近邻后端 (例如 ann_index.IVFPQIndex)，为 None 时使用暴力检索
+
+    def __len__(self):
+        """索引中的行数 (min 模式下为样本数，centroid 模式下等于用户数)。"""
+        return self._size
+
+    def __contains__(self, user_id):
+        return user_id in self._user_rows
+
+    @property
+    def user_count(self):
+        return len(self._user_rows)
+
+    def _ensure_capacity(self, required):
+        capacity = self._matrix.shape[0]
+        if required <= capacity:
+            return
+        new_capacity = max(required, capacity * 2) # 按倍数扩容，摊还后追加为 O(1)
+        if self._ann is not None and self._ann.trained:
+            self._ann.ensure_capacity(new_capacity)
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        user_ids = np.empty(new_capacity, dtype=object)
+        user_ids[:self._size] = self._user_ids[:self._size]
+        keys = np.empty(new_capacity, dtype=object)
+        keys[:self._size] = self._keys[:self._size]
+        self._matrix, self._sq_norms, self._user_ids, self._keys = matrix, sq_norms, user_ids, keys
+
+    def _as_vector(self, encoding):
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"人脸编码维度应为 {self.dim}，实际为 {vector.shape[0]}")
+        return vector
+
+    def build(self, user_ids, encodings, metadata=None, sample_keys=None, aggregation=None):
+        """用给定的样本整体重建索引。
+
+        Args:
+            user_ids: 每个样本所属的用户ID (同一用户可出现多次)。
+            encodings: (N, dim) 的样本编码。
+            metadata: 与 user_ids 平行的元数据 dict 列表 (可选)。
+            sample_keys: 与 user_ids 平行的样本键，默认与用户ID相同 (每个用户一个样本)。
+            aggregation: 'min' 或 'centroid'，None 表示沿用当前设置。
+        """
+        user_ids = list(user_ids)
+        sample_keys = list(sample_keys) if sample_keys is not None else user_ids
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(len(user_ids), self.dim)
+        with self._lock:
+            if aggregation is not None:
+                self.aggregation = aggregation
+            self._metadata = dict(zip(user_ids, metadata)) if metadata is not None else {}
+            if self.aggregation == 'centroid' and len(set(user_ids)) < len(user_ids):
+                # 按用户求样本均值: np.add.at 一次累加所有样本
+                slots = {}
+                inverse = np.fromiter((slots.setdefault(user_id, len(slots)) for user_id in user_ids),
+                                      dtype=np.int64, count=len(user_ids))
+                sums = np.zeros((len(slots), self.dim), dtype=np.float64)
+                np.add.at(sums, inverse, vectors)
+                vectors = (sums / np.bincount(inverse)[:, None]).astype(np.float32)
+                user_ids = sample_keys = list(slots)
+            elif self.aggregation == 'centroid':
+                sample_keys = user_ids
+
+            count = len(user_ids)
+            capacity = max(count, 1024)
+            self._matrix = np.empty((capacity, self.dim), dtype=np.float32)
+            self._sq_norms = np.empty(capacity, dtype=np.float32)
+            self._user_ids = np.empty(capacity, dtype=object)
+            self._keys = np.empty(capacity, dtype=object)
+            self._positions = {}
+            self._user_rows = {}
+            self._size = 0
+            if count:
+                self._matrix[:count] = vectors
+                self._sq_norms[:count] = np.einsum('ij,ij->i', self._matrix[:count], self._matrix[:count])
+                self._user_ids[:count] = user_ids
+                self._keys[:count] = sample_keys
+                self._positions = {key: row for row, key in enumerate(sample_keys)}
+                for user_id, key in zip(user_ids, sample_keys):
+                    self._user_rows.setdefault(user_id, set()).add(key)
+                self._size = count
+            self._max_rows_per_user = max((len(keys) for keys in self._user_rows.values()), default=1)
+            if self._ann is not None and self._ann.trained:
+                self._ann.reset(self._matrix.shape[0])
+                self._ann.add_rows(np.arange(count), self._matrix[:count])
+
+    def _put_row_locked(self, key, user_id, vector):
+        """(Internal) 调用方需持有锁。添加或替换行键为 key 的一行。"""
+        row = self._positions.get(key)
+        if row is None:
+            self._ensure_capacity(self._size + 1)
+            row = self._size
+            self._size += 1
+            self._positions[key] = row
+            self._keys[row] = key
+            self._user_ids[row] = user_id
+            rows = self._user_rows.setdefault(user_id, set())
+            rows.add(key)
+            self._max_rows_per_user = max(self._max_rows_per_user, len(rows))
+        elif self._ann is not None and self._ann.trained:
+            self._ann.remove_row(row)
+        self._matrix[row] = vector
+        self._sq_norms[row] = float(vector @ vector)
+        if self._ann is not None and self._ann.trained:
+            self._ann.add_rows([row], vector)
+
+    def _delete_row_locked(self, key):
+        """(Internal) 调用方需持有锁。删除一行：用最后一行覆盖被删除的行，避免整体移动数据。"""
+        row = self._positions.pop(key, None)
+        if row is None:
+            return False
+        user_id = self._user_ids[row]
+        rows = self._user_rows.get(user_id)
+        if rows is not None:
+            rows.discard(key)
+            if not rows:
+                del self._user_rows[user_id]
+        last = self._size - 1
+        ann = self._ann if self._ann is not None and self._ann.trained else None
+        if ann is not None:
+            ann.remove_row(row)
+        if row != last:
+            if ann is not None:
+                ann.move_row(last, row)
+            moved_key = self._keys[last]
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._user_ids[row] = self._user_ids[last]
+            self._keys[row] = moved_key
+            self._positions[moved_key] = row
+        self._user_ids[last] = None
+        self._keys[last] = None
+        self._size = last
+        return True
+
+    def add(self, user_id, encoding, metadata=None):
+        """增量添加(或替换)一个只有单个样本的用户 (例如新注册的用户)，metadata 不为 None 时同时替换其元数据。"""
+        self.set_user_samples(user_id, [user_id], [encoding], metadata)
+
+    def set_user_samples(self, user_id, sample_keys, encodings, metadata=None):
+        """用给定的全部样本替换一个用户在索引中的行 (按 aggregation 放入多行或一行均值)。"""
+        vectors = [self._as_vector(encoding) for encoding in encodings]
+        if not vectors:
+            raise ValueError("用户至少需要一个人脸样本")
+        if self.aggregation == 'centroid':
+            rows = {user_id: np.mean(vectors, axis=0).astype(np.float32)}
+        else:
+            rows = dict(zip(sample_keys, vectors))
+        with self._lock:
+            if metadata is not None:
+                self._metadata[user_id] = metadata
+            for key in list(self._user_rows.get(user_id, ())):
+                if key not in rows:
+                    self._delete_row_locked(key)
+            for key, vector in rows.items():
+                self._put_row_locked(key, user_id, vector)
+
+    def remove(self, user_id):
+        """删除一个用户的全部行及元数据。"""
+        with self._lock:
+            self._metadata.pop(user_id, None)
+            keys = self._user_rows.get(user_id)
+            if not keys:
+                return False
+            for key in list(keys):
+                self._delete_row_locked(key)
+            return True
+
+    def get_metadata(self, user_id):
+        """返回用户的元数据 dict，用户不在索引中或没有元数据时返回 None。"""
+        return self._metadata.get(user_id)
+
+    def _sq_distances_locked(self, query):
+        """(Internal) 调用方需持有锁。返回查询编码与前 _size 行的平方距离。"""
+        # ||g - q||^2 = ||g||^2 - 2 g·q + ||q||^2，一次矩阵-向量乘法完成全部计算
+        sq_dists = self._sq_norms[:self._size] - 2.0 * (self._matrix[:self._size] @ query) + float(query @ query)
+        np.maximum(sq_dists, 0.0, out=sq_dists) # 消除浮点误差导致的负数
+        return sq_dists
+
+    def distances(self, encoding):
+        """计算查询编码与库中所有编码的欧氏距离。
+
+        Returns:
+            (user_ids, distances): 两个等长的 numpy 数组 (均为副本，可在锁外使用)。
+        """
+        query = self._as_vector(encoding)
+        with self._lock:
+            if self._size == 0:
+                return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+            sq_dists = self._sq_distances_locked(query)
+            user_ids = self._user_ids[:self._size].copy()
+        return user_ids, np.sqrt(sq_dists)
+
+    def search(self, encoding, k=1):
+        """最近邻检索：返回距离最近的 k 个用户。
+
+        暴力模式下计算与全部编码的距离；启用 ANN 后端时只对其给出的候选做精确精排。
+        两种模式都使用 np.argpartition 做部分选择，只对选出的 k 个结果排序，
+        而不是对整个人脸库做完整排序。
+
+        Returns:
+            list[tuple[str, float]]: 按距离升序排列的 (user_id, distance) 列表。
+        """
+        query = self._as_vector(encoding)
+        with self._lock:
+            size = self._size
+            if size == 0 or k <= 0:
+                return []
+            k = min(k, len(self._user_rows))
+            ann = self._ann
+            if ann is not None and ann.trained and size > ann.rerank:
+                rows = ann.search_candidates(query, max(ann.rerank, k * self._max_rows_per_user))
+                # 精排: 用原始 float32 编码重新计算候选的精确距离
+                sq_dists = self._sq_norms[rows] - 2.0 * (self._matrix[rows] @ query) + float(query @ query)
+                np.maximum(sq_dists, 0.0, out=sq_dists)
+            else:
+                rows = np.arange(size)
+                sq_dists = self._sq_distances_locked(query)
+            return self._top_users_locked(rows, sq_dists, k)
+
+    def _top_users_locked(self, rows, sq_dists, k):
+        """(Internal) 调用方需持有锁。从候选行中选出距离最近的 k 个不同用户 (多个样本时取最小距离)。
+
+        每个用户最多占 _max_rows_per_user 行，所以距离最近的 k * _max_rows_per_user 行中
+        一定包含距离最近的 k 个不同用户；只对这些行做部分选择和排序。
+        """
+        take = min(k * self._max_rows_per_user, rows.shape[0])
+        if take == 0:
+            return []
+        if take < rows.shape[0]:
+            candidates = np.argpartition(sq_dists, take - 1)[:take]
+        else:
+            candidates = np.arange(rows.shape[0])
+        candidates = candidates[np.argsort(sq_dists[candidates], kind='stable')]
+        user_ids = self._user_ids[rows[candidates]]
+        if self._max_rows_per_user == 1:
+            return [(user_id, float(np.sqrt(sq_dists[i]))) for user_id, i in zip(user_ids[:k], candidates[:k])]
+        results = []
+        seen = set()
+        for user_id, i in zip(user_ids, candidates):
+            if user_id in seen:
+                continue
+            seen.add(user_id)
+            results.append((user_id, float(np.sqrt(sq_dists[i]))))
+            if len(results) == k:
+                break
+        return results
+
+    def search_batch(self, encodings, k=1):
+        """批量最近邻检索：一次矩阵-矩阵乘法计算所有查询与人脸库的距离。
+
+        Args:
+            encodings: (B, dim) 的查询编码。
+        Returns:
+            list[list[tuple[str, float]]]: 每个查询对应一个按距离升序排列的 (user_id, distance) 列表。
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if queries.shape[0] == 0:
+            return []
+        with self._lock:
+            size = self._size
+            if size == 0 or k <= 0:
+                return [[] for _ in range(queries.shape[0])]
+            ann = self._ann
+            if ann is not None and ann.trained and size > ann.rerank:
+                # ANN 的候选集合因查询而异，逐个检索 (每个查询本身是亚线性的)
+                return [self.search(query, k=k) for query in queries]
+            k = min(k, len(self._user_rows))
+            # ||g - q||^2 = ||g||^2 - 2 Q·G^T + ||q||^2，得到 (B, N) 距离矩阵
+            sq_dists = self._sq_norms[None, :size] - 2.0 * (queries @ self._matrix[:size].T) \
+                + np.einsum('ij,ij->i', queries, queries)[:, None]
+            np.maximum(sq_dists, 0.0, out=sq_dists)
+            if self._max_rows_per_user > 1:
+                # 同一用户有多行时逐个查询按用户聚合 (距离矩阵仍是一次计算得到的)
+                rows = np.arange(size)
+                return [self._top_users_locked(rows, query_dists, k) for query_dists in sq_dists]
+            if k < size:
+                candidates = np.argpartition(sq_dists, k - 1, axis=1)[:, :k]
+            else:
+                candidates = np.broadcast_to(np.arange(size), (queries.shape[0], size))
+            candidate_dists = np.take_along_axis(sq_dists, candidates, axis=1)
+            order = np.argsort(candidate_dists, axis=1, kind='stable')
+            candidates = np.take_along_axis(candidates, order, axis=1)
+            candidate_dists = np.sqrt(np.take_along_axis(candidate_dists, order, axis=1))
+            user_ids = self._user_ids[candidates]
+        return [
+            [(user_id, float(distance)) for user_id, distance in zip(row_ids, row_dists)]
+            for row_ids, row_dists in zip(user_ids, candidate_dists)
+        ]
+
+    # --- 近似最近邻 (ANN) 后端 ---
+
+    @property
+    def ann(self):
+        return self._ann
+
+    def set_ann(self, ann):
+        """设置 ANN 后端 (None 表示暴力检索)。若后端已训练，则立即为现有编码建立倒排列表。"""
+        with self._lock:
+            self._ann = ann
+            if ann is not None and ann.trained:
+                ann.reset(self._matrix.shape[0])
+                ann.add_rows(np.arange(self._size), self._matrix[:self._size])
+
+    def train_ann(self, ann):
+        """用当前人脸库训练 ANN 后端并启用它。"""
+        with self._lock:
+            vectors = self._matrix[:self._size].copy()
+        ann.train(vectors) # 训练耗时较长，在锁外进行
+        self.set_ann(ann)
+
+    def save_ann(self, path):
+        """把当前 ANN 后端 (量化器及每一行的编码) 持久化到磁盘。"""
+        with self._lock:
+            if self._ann is None or not self._ann.trained:
+                raise ValueError("ANN 后端未启用或尚未训练")
+            self._ann.save(path, self._keys, self._size)
+
+    def load_ann(self, ann, path):
+        """从磁盘加载 ANN 后端。文件中已有的行 (按行键对应) 直接复用其编码，新增的行重新计算，已删除的行被忽略。"""
+        persisted = ann.load(path)
+        with self._lock:
+            ann.reset(self._matrix.shape[0])
+            known_rows, known_lists, known_codes, missing_rows = [], [], [], []
+            for row in range(self._size):
+                entry = persisted.get(self._keys[row])
+                if entry is None:
+                    missing_rows.append(row)
+                else:
+                    known_rows.append(row)
+                    known_lists.append(entry[0])
+                    known_codes.append(entry[1])
+            if known_rows:
+                ann.add_rows(known_rows, list_ids=np.asarray(known_lists), codes=np.asarray(known_codes, dtype=np.uint8))
+            if missing_rows:
+                ann.add_rows(missing_rows, self._matrix[missing_rows])
+            self._ann = ann
+        return len(known_rows), len(missing_rows)
+
+# 进程级单例，在 create_app 时构建，由 data_store 增量维护
+gallery_index = FaceIndex()
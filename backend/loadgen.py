@@ -0,0 +1,145 @@
+"""签到接口压测脚本：对比 WSGI (python app.py / gunicorn) 与 ASGI (uvicorn) 两种运行模式能承载的并发。
+
+模拟大量签到终端同时上传照片，--upload-delay 让每个请求在该时间内分块慢速发送请求体，
+用来模拟网络较差、长时间占用连接的终端 (WSGI 模式下每个这样的请求会占住一个线程)。
+
+示例:
+    python app.py                                                  # WSGI, 端口 5000
+    uvicorn asgi:create_asgi_app --factory --port 8000             # ASGI
+    python loadgen.py --photo face.jpg --concurrency 200 --requests 2000 --upload-delay 2 \\
+        --url wsgi=http://127.0.0.1:5000 --url asgi=http://127.0.0.1:8000
+
+注意: 同一张照片重复签到会被签到去抖拦截 (不写数据库)，需要测量写入时可把 SIGNIN_DEDUP_WINDOW_SECONDS 设为 0。
+依赖: httpx
+"""
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
+
+UPLOAD_CHUNKS = 10 # 慢速上传时请求体被拆分的块数
+
+def build_multipart(field, filename, data, fields=None):
+    """构造 multipart/form-data 请求体，返回 (body, content_type)。"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+async def _slow_body(body, delay):
+    """把请求体分成 UPLOAD_CHUNKS 块，在 delay 秒内逐块发送。"""
+    chunk_size = -(-len(body) // UPLOAD_CHUNKS)
+    for start in range(0, len(body), chunk_size):
+        yield body[start:start + chunk_size]
+        await asyncio.sleep(delay / UPLOAD_CHUNKS)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+async def run_target(url, body, content_type, args):
+    """对一个服务地址发起 args.requests 个请求 (最多 args.concurrency 个同时进行)，返回统计结果。"""
+    latencies = []
+    statuses = Counter()
+    in_flight = 0
+    peak_in_flight = 0
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        async def worker():
+            nonlocal in_flight, peak_in_flight
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                content = _slow_body(body, args.upload_delay) if args.upload_delay > 0 else body
+                in_flight += 1
+                peak_in_flight = max(peak_in_flight, in_flight)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(args.endpoint, content=content, headers={'Content-Type': content_type})
+                    statuses[str(response.status_code)] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                finally:
+                    latencies.append(time.perf_counter() - start)
+                    in_flight -= 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    completed = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 500)
+    return {
+        'requests': args.requests,
+        'completed': completed, # 收到非 5xx 响应的请求数 (4xx 例如未匹配到用户也算服务端正常处理)
+        'statuses': dict(statuses),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(completed / elapsed, 2) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'latency_p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_in_flight': peak_in_flight,
+        # Little 定律: 平均同时处理中的请求数 = 总停留时间 / 墙钟时间，即服务端实际承载的并发
+        'effective_concurrency': round(sum(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+def parse_targets(values):
+    targets = []
+    for value in values:
+        label, sep, url = value.partition('=')
+        targets.append((label, url) if sep else (value, value))
+    return targets
+
+async def main(args):
+    with open(args.photo, 'rb') as f:
+        photo = f.read()
+    fields = {'name': args.name} if args.endpoint.rstrip('/').endswith('/register') else None
+    body, content_type = build_multipart('photo', 'photo.jpg', photo, fields)
+
+    report = {}
+    for label, url in parse_targets(args.url):
+        print(f"压测 {label} ({url}{args.endpoint}): {args.requests} 个请求, 并发 {args.concurrency}, 上传耗时 {args.upload_delay}s")
+        report[label] = await run_target(url, body, content_type, args)
+        stats = report[label]
+        print(f"  完成 {stats['completed']}/{stats['requests']}, 状态 {stats['statuses']}, "
+              f"吞吐 {stats['throughput_rps']} req/s, p50/p95/p99 {stats['latency_p50_ms']}/"
+              f"{stats['latency_p95_ms']}/{stats['latency_p99_ms']} ms, 有效并发 {stats['effective_concurrency']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="签到接口并发压测 (WSGI / ASGI 对比)")
+    parser.add_argument('--url', action='append', required=True, help="服务地址，可写成 label=url，可重复以依次压测多个服务")
+    parser.add_argument('--photo', required=True, help="上传的人脸照片")
+    parser.add_argument('--endpoint', default='/attendance/sign', help="压测的接口路径 (默认 /attendance/sign)")
+    parser.add_argument('--name', default='loadgen', help="压测 /user/register 时使用的姓名")
+    parser.add_argument('--concurrency', type=int, default=100, help="同时进行的请求数 (模拟的终端数)")
+    parser.add_argument('--requests', type=int, default=1000, help="每个服务的请求总数")
+    parser.add_argument('--upload-delay', type=float, default=0.0, help="每个请求体分块发送的总耗时 (秒)，模拟慢速上传")
+    parser.add_argument('--timeout', type=float, default=60.0, help="单个请求的超时时间 (秒)")
+    parser.add_argument('--output', help="把统计结果以 JSON 写入该文件")
+    asyncio.run(main(parser.parse_args()))
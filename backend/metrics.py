@@ -0,0 +1,262 @@
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+# 轻量级指标与结构化日志 (不依赖 prometheus_client)：
+# - 计数器 / 直方图在请求路径上只做一次加锁累加，开销可以忽略；
+# - 仪表 (人脸库规模、缓存命中率等) 只在抓取 /metrics 时通过回调读取，不占用请求路径；
+# - 每个请求的各阶段耗时记录在 contextvars 中 (线程与 asyncio 任务都适用)，请求结束时输出一行 JSON 日志。
+# 指标按进程统计，多进程部署时由 Prometheus 分别抓取各进程再聚合。
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} # 标签值元组 -> 计数
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {} # 标签值元组 -> [各区间计数 (非累计，最后一项为 +Inf), 总和, 总数]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class CallbackMetric:
+    """抓取时调用 fn() 取值的指标。fn 返回数值，或 {标签值元组: 数值} (配合 labelnames)。"""
+
+    def __init__(self, name, documentation, fn, type='gauge', labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e: # 回调出错不影响其他指标的输出
+            print(f"读取指标 {self.name} 失败: {e}")
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(item)}" for key, item in sorted(value.items())]
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {} # 指标名 -> 指标对象 (按注册顺序输出)
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric # 同名指标重新注册时替换 (例如多次 create_app)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, fn, type='gauge', labelnames=()):
+        return self.register(CallbackMetric(name, documentation, fn, type, labelnames))
+
+    def render(self):
+        """输出 Prometheus 文本格式 (text/plain; version=0.0.4)。"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# 进程级指标注册表
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'face_http_request_seconds', 'HTTP 请求处理耗时 (秒)', ['endpoint', 'method', 'status'])
+STAGE_SECONDS = registry.histogram(
+    'face_stage_seconds', '签到/注册各阶段耗时 (秒): decode/resize/detect/encode 为工作进程内的编码阶段，'
+    'encoder_total 为等待编码结果的总耗时，match 为人脸库比对，db_write 为数据库写入', ['stage'])
+MATCH_TOTAL = registry.counter(
+    'face_match_total', '人脸比对结果计数 (match: 匹配成功，no_match: 超出阈值，no_face: 未检测到人脸)', ['result'])
+
+# --- 结构化日志 ---
+
+logger = logging.getLogger('face_recognize')
+_request_stages = contextvars.ContextVar('face_request_stages', default=None)
+
+def log_event(event, level=logging.INFO, **fields):
+    """输出一行 JSON 日志 (logger 未启用该级别时不做序列化)。"""
+    if not logger.isEnabledFor(level):
+        return
+    record = {'ts': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"), 'event': event, **fields}
+    logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+def observe_stage(stage, seconds):
+    """记录一个阶段的耗时：写入直方图，并累加到当前请求的阶段耗时中 (用于请求日志)。"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+class RequestTracker:
+    """记录一个请求的总耗时和各阶段耗时：start() 在请求开始时调用，finish(status) 在得到响应后调用。"""
+
+    def __init__(self, endpoint, method, path):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.status = 500 # 未调用 finish 前发生异常时按 500 记录
+        self._started = None
+        self._token = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._token = _request_stages.set({})
+        return self
+
+    def finish(self, status=None):
+        if self._started is None:
+            return
+        if status is not None:
+            self.status = status
+        elapsed = time.perf_counter() - self._started
+        self._started = None
+        REQUEST_SECONDS.observe(elapsed, endpoint=self.endpoint, method=self.method, status=self.status)
+        stages = _request_stages.get() or {}
+        try:
+            _request_stages.reset(self._token)
+        except ValueError: # finish 与 start 不在同一个上下文中执行
+            _request_stages.set(None)
+        log_event('request', method=self.method, path=self.path, endpoint=self.endpoint, status=self.status,
+                  duration_ms=round(elapsed * 1000, 2), stages={stage: round(ms, 2) for stage, ms in stages.items()})
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+        return False
+
+def init_app(app):
+    """注册请求计时钩子、/metrics 接口以及从各单例读取的仪表，并按配置启用结构化日志。"""
+    from flask import g, request, Response
+
+    if app.config.get('STRUCTURED_LOGGING', True) and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+        logger.propagate = False
+
+    @app.before_request
+    def _start_request_metrics():
+        if request.path != '/metrics':
+            g.request_tracker = RequestTracker(request.endpoint or 'unknown', request.method, request.path).start()
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        tracker = g.pop('request_tracker', None)
+        if tracker is not None:
+            tracker.finish(response.status_code)
+        return response
+
+    if app.config.get('METRICS_ENABLED', True):
+        @app.route('/metrics')
+        def metrics_endpoint():
+            return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    from face_index import gallery_index
+    from face_encoder import encoder_pool
+    from signin_debounce import signin_debouncer
+
+    def cache_stat(name):
+        def read():
+            return encoder_pool.cache.stats()[name] if encoder_pool.cache is not None else 0
+        return read
+
+    registry.callback('face_gallery_size', '人脸库索引中的用户数', lambda: gallery_index.user_count)
+    registry.callback('face_gallery_rows', '人脸库索引中的编码行数 (min 聚合时为样本总数)', lambda: len(gallery_index))
+    registry.callback('face_gallery_ann_enabled', '人脸库是否使用 ANN 索引 (1 是, 0 否)',
+                      lambda: int(gallery_index.ann is not None and gallery_index.ann.trained))
+    registry.callback('face_encoding_cache_entries', '编码缓存内存层的条目数', cache_stat('entries'))
+    registry.callback('face_encoding_cache_lookups_total', '编码缓存查询次数 (result: hit / disk_hit / miss)',
+                      lambda: {(result,): cache_stat(key)() for result, key in
+                               (('hit', 'hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'))},
+                      type='counter', labelnames=['result'])
+    registry.callback('face_encoding_cache_hit_ratio', '编码缓存命中率 (含磁盘层)', cache_stat('hit_rate'))
+    registry.callback('face_signin_debounce_suppressed_total', '被签到去抖跳过的写入次数',
+                      lambda: signin_debouncer.stats()['suppressed'], type='counter')
@@ -11,23 +11,38 @@ def generate_uuid():
 
 class User(db.Model):
     __tablename__ = 'users'
+    # 用户列表按注册时间倒序键集分页
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
     name = db.Column(db.String(100), nullable=False)
-    face_data = db.Column(db.Text, nullable=False)  # 存储模拟的特征向量，用Text可以存较长字符串
-    photo_filename = db.Column(db.String(255), nullable=False)
+    # 旧格式: JSON 文本形式的人脸编码 (约 2.5 KB)。仅为兼容尚未迁移的旧数据而保留，新用户不再写入
+    face_data = db.Column(db.Text, nullable=True)
+    # 新格式: 128 个小端 float32 组成的 512 字节二进制人脸编码，读取时用 np.frombuffer 零拷贝解码
+    face_encoding = db.Column(db.LargeBinary(512), nullable=True)
+    photo_filename = db.Column(db.String(255), nullable=False) # 相对 UPLOAD_FOLDER 的路径，见 photo_store.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # 定义与签到记录的一对多关系
     # backref='user' 使得可以在 AttendanceRecord 对象上通过 .user 访问关联的 User 对象
     # lazy=True (默认) 表示 SQLAlchemy 会在第一次访问时按需加载相关对象
     attendance_records = db.relationship('AttendanceRecord', backref='user', lazy=True, cascade="all, delete-orphan")
+    daily_summaries = db.relationship('AttendanceDailySummary', lazy=True, cascade="all, delete-orphan")
+    # 注册照片之外的其他人脸样本 (face_encoding 仍是注册时的样本)
+    face_samples = db.relationship('FaceEncoding', lazy=True, cascade="all, delete-orphan")
 
     def __repr__(self):
         return f'<User {self.name} ({self.id})>'
 
 class AttendanceRecord(db.Model):
     __tablename__ = 'attendance_records'
+    # 按时间倒序的分页/导出查询走 timestamp 索引；按用户筛选时走 (user_id, timestamp) 复合索引
+    __table_args__ = (
+        db.Index('ix_attendance_records_timestamp', 'timestamp'),
+        db.Index('ix_attendance_records_user_id_timestamp', 'user_id', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True) # 自动递增的 ID
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
@@ -36,4 +51,36 @@ class AttendanceRecord(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
-        return f'<AttendanceRecord for user_id={self.user_id} at {self.timestamp}>' 
\ No newline at end of file
+        return f'<AttendanceRecord for user_id={self.user_id} at {self.timestamp}>' 
+
+class AttendanceDailySummary(db.Model):
+    """每个用户每天 (UTC) 的签到汇总，由 attendance_rollup 在写入签到记录时增量维护，
+    统计接口直接读取该表，无需扫描原始签到记录。"""
+    __tablename__ = 'attendance_daily_summary'
+    __table_args__ = (
+        db.Index('ix_attendance_daily_summary_user_id_day', 'user_id', 'day'),
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    sign_in_count = db.Column(db.Integer, nullable=False, default=0)
+    first_sign_in = db.Column(db.DateTime, nullable=False)
+    last_sign_in = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<AttendanceDailySummary user_id={self.user_id} day={self.day} count={self.sign_in_count}>'
+
+class FaceEncoding(db.Model):
+    """用户的额外人脸样本 (不同光线、角度下的照片)，与 User.face_encoding 一起参与比对。
+    source 为 'manual' 表示管理员上传的样本，'adaptive' 表示由高置信度签到自动加入的样本。"""
+    __tablename__ = 'face_encodings'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
+    encoding = db.Column(db.LargeBinary(512), nullable=False) # 与 User.face_encoding 格式相同
+    source = db.Column(db.String(16), nullable=False, default='manual')
+    photo_filename = db.Column(db.String(255), nullable=True) # 自动加入的样本不保存照片
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<FaceEncoding {self.id} for user_id={self.user_id} ({self.source})>'
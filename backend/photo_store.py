@@ -0,0 +1,110 @@
+import os
+import uuid
+import shutil
+import hashlib
+
+from PIL import Image
+
+# 照片文件的存储布局 (均相对于 UPLOAD_FOLDER，数据库中的 photo_filename 保存的就是这个相对路径):
+#   原图:   ab/cd/<uuid>.jpg          按文件名哈希的前两级分片，避免单个目录下堆积数十万个文件
+#   缩略图: thumbs/ab/cd/<uuid>.jpg    注册时生成；旧照片在第一次被请求时补生成
+# 旧版本保存在 UPLOAD_FOLDER 根目录下的照片 (不含分片目录) 仍可正常访问，
+# 可通过 flask shard-photos 迁移到分片目录。
+
+THUMBNAIL_DIR = 'thumbs'
+DEFAULT_THUMBNAIL_SIZE = 160 # 缩略图最长边的像素数
+THUMBNAIL_QUALITY = 85
+
+def shard_filename(name):
+    """把文件名放入按哈希分片的子目录，例如 'ab/cd/<name>'。"""
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+def new_photo_filename(ext='.jpg'):
+    """生成新照片的相对路径 (随机文件名 + 分片子目录)。"""
+    return shard_filename(f"{uuid.uuid4()}{ext}")
+
+def photo_path(upload_folder, photo_filename):
+    """照片相对路径 -> 磁盘上的路径。"""
+    return os.path.join(upload_folder, *photo_filename.split('/'))
+
+def thumbnail_filename(photo_filename):
+    """照片对应的缩略图相对路径 (缩略图统一保存为 JPEG)。"""
+    return f"{THUMBNAIL_DIR}/{os.path.splitext(photo_filename)[0]}.jpg"
+
+def _ensure_parent(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+def make_thumbnail(upload_folder, photo_filename, size=DEFAULT_THUMBNAIL_SIZE):
+    """由原图生成缩略图 (先写临时文件再原子替换，并发生成同一张缩略图也不会读到半个文件)。成功返回 True。"""
+    source = photo_path(upload_folder, photo_filename)
+    target = photo_path(upload_folder, thumbnail_filename(photo_filename))
+    temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        _ensure_parent(target)
+        with Image.open(source) as img:
+            img.draft('RGB', (size, size)) # JPEG 在解码时直接缩小，大图生成缩略图也很快
+            img = img.convert('RGB')
+            img.thumbnail((size, size))
+            img.save(temp_path, 'JPEG', quality=THUMBNAIL_QUALITY)
+        os.replace(temp_path, target)
+        return True
+    except (OSError, ValueError) as e:
+        print(f"生成缩略图失败: {photo_filename}, 错误: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+
+def ensure_thumbnail(upload_folder, photo_filename, size=DEFAULT_THUMBNAIL_SIZE):
+    """返回缩略图的相对路径；缩略图不存在时由原图补生成，原图也不存在或生成失败时返回 None。"""
+    thumbnail = thumbnail_filename(photo_filename)
+    if os.path.exists(photo_path(upload_folder, thumbnail)):
+        return thumbnail
+    if not os.path.exists(photo_path(upload_folder, photo_filename)):
+        return None
+    return thumbnail if make_thumbnail(upload_folder, photo_filename, size) else None
+
+def save_photo(upload_folder, image_bytes, ext='.jpg', thumbnail_size=DEFAULT_THUMBNAIL_SIZE):
+    """把照片写入分片目录并生成缩略图 (缩略图失败不影响保存)，返回照片的相对路径。写入失败时抛出 OSError。"""
+    photo_filename = new_photo_filename(ext)
+    path = photo_path(upload_folder, photo_filename)
+    _ensure_parent(path)
+    with open(path, 'wb') as f:
+        f.write(image_bytes)
+    if thumbnail_size:
+        make_thumbnail(upload_folder, photo_filename, thumbnail_size)
+    return photo_filename
+
+def copy_photo(upload_folder, source_path, thumbnail_size=DEFAULT_THUMBNAIL_SIZE):
+    """把已有的图片文件复制到分片目录并生成缩略图 (批量导入使用)，返回照片的相对路径。"""
+    photo_filename = new_photo_filename(os.path.splitext(source_path)[1].lower() or '.jpg')
+    path = photo_path(upload_folder, photo_filename)
+    _ensure_parent(path)
+    shutil.copyfile(source_path, path)
+    if thumbnail_size:
+        make_thumbnail(upload_folder, photo_filename, thumbnail_size)
+    return photo_filename
+
+def move_to_shard(upload_folder, photo_filename):
+    """把旧版本保存在根目录下的照片 (及其缩略图) 移动到分片目录，返回新的相对路径；已在分片目录中时原样返回。"""
+    if '/' in photo_filename:
+        return photo_filename
+    sharded = shard_filename(photo_filename)
+    for old, new in ((photo_filename, sharded), (thumbnail_filename(photo_filename), thumbnail_filename(sharded))):
+        old_path = photo_path(upload_folder, old)
+        if os.path.exists(old_path):
+            new_path = photo_path(upload_folder, new)
+            _ensure_parent(new_path)
+            os.replace(old_path, new_path)
+    return sharded
+
+def delete_photo(upload_folder, photo_filename):
+    """删除照片及其缩略图，文件不存在或删除失败时只打印日志。"""
+    for relative_path in (photo_filename, thumbnail_filename(photo_filename)):
+        path = photo_path(upload_folder, relative_path)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+                print(f"已删除照片文件: {path}")
+            except OSError as e_os:
+                print(f"删除照片文件失败: {path}, 错误: {e_os}")
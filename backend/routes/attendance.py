@@ -1,6 +1,11 @@
-from flask import Blueprint, request, jsonify, current_app
+import io
+import csv
+import json
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from utils import admin_required
 import data_store
+import metrics
 
 attendance_bp = Blueprint('attendance', __name__, url_prefix='/attendance')
 
@@ -12,31 +17,244 @@ def sign_in_route():
     photo_file = request.files['photo']
     if photo_file.filename == '':
         return jsonify(message="未选择签到照片文件"), 400
+
+    # 多人模式: 一张合照为其中所有已注册用户签到
+    if request.values.get('multi', '').lower() in ('1', 'true', 'yes'):
+        return _multi_face_sign_in(photo_file)
     
     uploaded_face_data = data_store.extract_face_data_without_saving(photo_file)
     
     if not uploaded_face_data:
+        metrics.MATCH_TOTAL.inc(result='no_face')
         return jsonify(message="签到照片人脸数据提取失败"), 500
 
-    matched_user_id = data_store.compare_stored_faces(uploaded_face_data)
-
-    if matched_user_id:
-        matched_user = data_store.find_user_by_id(matched_user_id) # matched_user is a User object
-        if matched_user:
-            # 不再需要传递 matched_user.name，因为 add_attendance_record 可以通过 user_id 关联
-            # timestamp = data_store.add_attendance_record(matched_user_id, matched_user.name)
-            timestamp = data_store.add_attendance_record(matched_user_id)
-            if timestamp: # 检查 add_attendance_record 是否成功
-                return jsonify(message=f"用户 {matched_user.name} 签到成功", user_id=matched_user_id, timestamp=timestamp.strftime("%Y-%m-%d %H:%M:%S")), 200
-            else:
-                return jsonify(message=f"用户 {matched_user.name} 签到失败，无法记录签到数据"), 500
-        else:
-            return jsonify(message="签到失败：匹配到的用户在数据库中不存在"), 500 # 理论上不应发生，因为 matched_user_id 来自数据库
-    else:
+    tolerance = current_app.config.get('FACE_MATCH_TOLERANCE', 0.6)
+    matched_user_id, distance = data_store.match_face(uploaded_face_data, tolerance=tolerance)
+
+    if not matched_user_id:
         return jsonify(message="签到失败：未匹配到用户"), 404
 
+    # 在去抖窗口内的重复签到直接返回已有记录 (duplicate=True)，不写数据库
+    recorded = data_store.record_attendance([matched_user_id])
+    if recorded is None:
+        return jsonify(message="签到失败，无法记录签到数据"), 500
+    signed = recorded.get(matched_user_id)
+    if not signed:
+        return jsonify(message="签到失败：匹配到的用户在数据库中不存在"), 500 # 用户可能刚被删除
+    if not signed['duplicate']:
+        data_store.apply_adaptive_sample(matched_user_id, uploaded_face_data, distance, current_app.config) # 可选的样本自动更新
+    message = f"用户 {signed['name']} 已于 {signed['timestamp']} 签到" if signed['duplicate'] else f"用户 {signed['name']} 签到成功"
+    return jsonify(message=message, user_id=matched_user_id,
+                   timestamp=signed['timestamp'], duplicate=signed['duplicate']), 200
+
+def _multi_face_sign_in(photo_file):
+    """识别合照中的每一张人脸，去重后为所有匹配到的用户批量记录签到"""
+    faces = data_store.extract_all_faces_without_saving(photo_file)
+    if faces is None:
+        return jsonify(message="签到照片人脸数据提取失败"), 500
+    if not faces:
+        metrics.MATCH_TOTAL.inc(result='no_face')
+        return jsonify(message="签到失败：照片中未检测到人脸", faces=[]), 404
+
+    tolerance = current_app.config.get('FACE_MATCH_TOLERANCE', 0.6)
+    k = current_app.config.get('FACE_MULTI_CANDIDATES', 3) # 每张人脸保留多个候选，身份冲突时可以退而选择次近的用户
+    nearest_list = data_store.identify_faces_batch([face['encoding'] for face in faces], k=k)
+    assigned = data_store.assign_unique_identities(nearest_list, tolerance=tolerance)
+
+    matched_user_ids = [match[0] for match in assigned if match]
+    recorded = data_store.record_attendance(matched_user_ids)
+    if recorded is None:
+        return jsonify(message="签到失败，无法记录签到数据"), 500
+
+    results = []
+    for face, match in zip(faces, assigned):
+        top, right, bottom, left = face['box']
+        result = {'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left}}
+        signed = recorded.get(match[0]) if match else None
+        if signed:
+            result.update(status='signed', user_id=match[0], distance=round(match[1], 4), **signed)
+        else:
+            result['status'] = 'no_match'
+        results.append(result)
+
+    matched_user_ids = [user_id for user_id in matched_user_ids if user_id in recorded]
+    if not matched_user_ids:
+        return jsonify(message="签到失败：未匹配到用户", faces=results), 404
+    return jsonify(message=f"检测到 {len(faces)} 张人脸，{len(matched_user_ids)} 位用户签到成功", faces=results), 200
+
+@attendance_bp.route('/sign/batch', methods=['POST'])
+def batch_sign_in_route():
+    """批量签到：一次上传多张照片 (字段名 photos)，返回与上传顺序一致的逐张结果"""
+    photo_files = [f for f in request.files.getlist('photos') if f.filename != '']
+    if not photo_files:
+        return jsonify(message="缺少签到照片文件"), 400
+
+    max_photos = current_app.config.get('ATTENDANCE_BATCH_MAX_PHOTOS', 32)
+    if len(photo_files) > max_photos:
+        return jsonify(message=f"每次最多上传 {max_photos} 张签到照片"), 400
+
+    tolerance = current_app.config.get('FACE_MATCH_TOLERANCE', 0.6)
+    face_data_list = data_store.extract_face_data_batch(photo_files)
+    nearest_list = data_store.identify_faces_batch(face_data_list, k=1)
+
+    results = []
+    matched = [] # (result, user_id, distance)
+    for index, (photo_file, face_data, nearest) in enumerate(zip(photo_files, face_data_list, nearest_list)):
+        result = {'index': index, 'filename': photo_file.filename}
+        if not face_data:
+            result['status'] = 'no_face'
+        elif not nearest or nearest[0][1] > tolerance:
+            result['status'] = 'no_match'
+        else:
+            matched.append((result, nearest[0][0], nearest[0][1]))
+        metrics.MATCH_TOTAL.inc(result=result.get('status', 'match'))
+        results.append(result)
+
+    # 同一批中同一用户只记录一次签到，去抖窗口内的重复签到不写数据库
+    recorded = data_store.record_attendance([user_id for _, user_id, _ in matched])
+    if recorded is None:
+        return jsonify(message="批量签到失败，无法记录签到数据"), 500
+
+    for result, user_id, distance in matched:
+        signed = recorded.get(user_id)
+        if signed:
+            result.update(status='signed', user_id=user_id, distance=round(distance, 4), **signed)
+        else:
+            result['status'] = 'no_match' # 匹配到的用户已不存在
+
+    return jsonify(message=f"批量签到完成，{len(recorded)} 位用户签到成功", results=results), 200
+
+@attendance_bp.route('/identify', methods=['POST'])
+@admin_required
+def identify_route():
+    """管理员上传照片，返回距离最近的 k 个用户及其距离 (不记录签到)"""
+    if 'photo' not in request.files:
+        return jsonify(message="缺少照片文件"), 400
+
+    photo_file = request.files['photo']
+    if photo_file.filename == '':
+        return jsonify(message="未选择照片文件"), 400
+
+    max_k = current_app.config.get('FACE_IDENTIFY_MAX_K', 50)
+    k = request.args.get('k', default=5, type=int)
+    if k is None or k < 1 or k > max_k:
+        return jsonify(message=f"参数 k 必须是 1 到 {max_k} 之间的整数"), 400
+
+    uploaded_face_data = data_store.extract_face_data_without_saving(photo_file)
+    if not uploaded_face_data:
+        return jsonify(message="照片人脸数据提取失败"), 500
+
+    nearest = data_store.identify_face(uploaded_face_data, k=k)
+    users = data_store.find_users_by_ids([user_id for user_id, _ in nearest])
+    tolerance = current_app.config.get('FACE_MATCH_TOLERANCE', 0.6)
+    candidates = [
+        {
+            'user_id': user_id,
+            'name': users[user_id].name if user_id in users else None,
+            'distance': round(distance, 4),
+            'matched': distance <= tolerance
+        } for user_id, distance in nearest
+    ]
+    return jsonify(candidates=candidates, tolerance=tolerance), 200
+
+def _parse_datetime_param(name, end=False):
+    """解析查询参数中的时间 (UTC)，支持 YYYY-MM-DD 和 YYYY-MM-DD HH:MM:SS 两种格式。
+
+    只给出日期的结束时间包含当天整天 (返回第二天 0 点作为不包含的上界)。
+    参数缺失时返回 None，格式不正确时抛出 ValueError。
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        pass
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"参数 {name} 的格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS")
+    return day + timedelta(days=1) if end else day
+
+def _parse_records_filters():
+    """解析签到记录的筛选参数 from / to / user_id。格式不正确时抛出 ValueError。"""
+    start = _parse_datetime_param('from')
+    end = _parse_datetime_param('to', end=True)
+    user_id = request.args.get('user_id') or None
+    return start, end, user_id
+
 @attendance_bp.route('/records', methods=['GET'])
 @admin_required
 def get_attendance_records_route(): 
-    records = data_store.get_all_attendance_records()
-    return jsonify(records=records), 200 
\ No newline at end of file
+    """分页查看签到记录，支持 from / to / user_id 筛选，翻页时传入上一页返回的 next_cursor"""
+    default_limit = current_app.config.get('ATTENDANCE_RECORDS_PAGE_SIZE', 100)
+    max_limit = current_app.config.get('ATTENDANCE_RECORDS_MAX_PAGE_SIZE', 1000)
+    limit = request.args.get('limit', default=default_limit, type=int)
+    if limit is None or limit < 1 or limit > max_limit:
+        return jsonify(message=f"参数 limit 必须是 1 到 {max_limit} 之间的整数"), 400
+
+    try:
+        start, end, user_id = _parse_records_filters()
+        records, next_cursor = data_store.get_attendance_records_page(
+            limit=limit, cursor=request.args.get('cursor'), start=start, end=end, user_id=user_id)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    return jsonify(records=records, next_cursor=next_cursor), 200
+
+@attendance_bp.route('/records/export', methods=['GET'])
+@admin_required
+def export_attendance_records_route():
+    """流式导出签到记录 (format=ndjson 或 csv)，边查询边输出，不在内存中保存全部记录"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify(message="参数 format 只能是 ndjson 或 csv"), 400
+    try:
+        start, end, user_id = _parse_records_filters()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    records = data_store.iter_attendance_records(start=start, end=end, user_id=user_id)
+    if export_format == 'ndjson':
+        lines = (json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson',
+                        headers={'Content-Disposition': 'attachment; filename=attendance_records.ndjson'})
+
+    def generate_csv():
+        fields = ['id', 'user_id', 'name', 'timestamp']
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            if buffer.tell() >= 64 * 1024: # 攒够一块再输出，减少小块写入的开销
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate_csv()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=attendance_records.csv'})
+
+
+@attendance_bp.route('/stats', methods=['GET'])
+@admin_required
+def attendance_stats_route():
+    """签到统计 (读取日汇总表)：group_by=day 按天统计，group_by=user 按用户统计"""
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in ('day', 'user'):
+        return jsonify(message="参数 group_by 只能是 day 或 user"), 400
+    try:
+        start = _parse_datetime_param('from')
+        end = _parse_datetime_param('to')
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    stats = data_store.get_attendance_stats(
+        group_by,
+        start_day=start.date() if start else None,
+        end_day=end.date() if end else None,
+        user_id=request.args.get('user_id') or None,
+    )
+    if stats is None:
+        return jsonify(message="获取签到统计失败"), 500
+    return jsonify(group_by=group_by, stats=stats), 200
@@ -17,7 +17,8 @@ def register_user_route():
         return jsonify(message="未选择照片文件"), 400
 
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    face_data, photo_filename = data_store.save_photo_and_extract_data(photo_file, upload_folder)
+    face_data, photo_filename = data_store.save_photo_and_extract_data(
+        photo_file, upload_folder, current_app.config.get('THUMBNAIL_SIZE', 160))
 
     if not face_data or not photo_filename:
         return jsonify(message="人脸数据提取或照片保存失败"), 500
@@ -35,18 +36,82 @@ def delete_user_route(user_id):
     else:
         return jsonify(message="未找到该用户或删除失败"), 404
 
+@user_bp.route('/<string:user_id>/samples', methods=['POST'])
+@admin_required
+def add_face_sample_route(user_id):
+    """管理员为已注册用户上传一张新的人脸照片 (不同光线、角度)，作为额外的比对样本"""
+    if 'photo' not in request.files:
+        return jsonify(message="缺少照片文件"), 400
+
+    photo_file = request.files['photo']
+    if photo_file.filename == '':
+        return jsonify(message="未选择照片文件"), 400
+
+    if data_store.find_user_by_id(user_id) is None:
+        return jsonify(message="未找到该用户"), 404
+    samples = data_store.get_face_samples(user_id)
+    if samples is None:
+        return jsonify(message="查询人脸样本失败"), 500
+    # 自动样本可以被替换，只有注册照片和手动上传的样本占用上限
+    max_samples = current_app.config.get('FACE_MAX_SAMPLES_PER_USER', 10)
+    if 1 + sum(1 for sample in samples if sample['source'] == 'manual') >= max_samples:
+        return jsonify(message=f"每个用户最多 {max_samples} 个人脸样本 (含注册照片)"), 400
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    face_data, photo_filename = data_store.save_photo_and_extract_data(
+        photo_file, upload_folder, current_app.config.get('THUMBNAIL_SIZE', 160))
+    if not face_data or not photo_filename:
+        return jsonify(message="人脸数据提取或照片保存失败"), 500
+
+    sample = data_store.add_face_sample(user_id, face_data, photo_filename, source='manual', max_samples=max_samples,
+                                        max_adaptive=current_app.config.get('FACE_ADAPTIVE_MAX_SAMPLES', 3))
+    if sample is None:
+        return jsonify(message="添加人脸样本失败，无法写入数据库"), 500
+    return jsonify(message="人脸样本添加成功", user_id=user_id, **sample), 201
+
+@user_bp.route('/<string:user_id>/samples', methods=['GET'])
+@admin_required
+def list_face_samples_route(user_id):
+    """管理员查看用户的额外人脸样本 (不含注册照片)"""
+    if data_store.find_user_by_id(user_id) is None:
+        return jsonify(message="未找到该用户"), 404
+    samples = data_store.get_face_samples(user_id)
+    if samples is None:
+        return jsonify(message="查询人脸样本失败"), 500
+    for sample in samples:
+        _add_photo_urls(sample)
+    return jsonify(user_id=user_id, samples=samples), 200
+
+@user_bp.route('/<string:user_id>/samples/<int:sample_id>', methods=['DELETE'])
+@admin_required
+def delete_face_sample_route(user_id, sample_id):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    if data_store.delete_face_sample(user_id, sample_id, upload_folder):
+        return jsonify(message="人脸样本已删除"), 200
+    return jsonify(message="未找到该人脸样本或删除失败"), 404
+
+def _add_photo_urls(info):
+    """为包含 photo_filename 的 dict 加上原图和缩略图的 URL ('serve_photo' / 'serve_thumbnail' 定义在 app.py 中)"""
+    if info.get('photo_filename'):
+        info['photo_url'] = url_for('serve_photo', filename=info['photo_filename'], _external=True)
+        info['thumbnail_url'] = url_for('serve_thumbnail', filename=info['photo_filename'], _external=True)
+    else:
+        info['photo_url'] = None
+        info['thumbnail_url'] = None
+    return info
+
 @user_bp.route('/list', methods=['GET'])
 @admin_required
 def list_all_users_route():
-    """管理员查看所有已注册用户列表 (ID, 姓名, 照片文件名, 照片URL)"""
-    users_summary_raw = data_store.get_all_users_summary()
-    users_summary_with_photo_url = []
-    for user_info in users_summary_raw:
-        if user_info.get('photo_filename'):
-            # 'serve_photo' 是我们在 app.py 中定义的函数名
-            user_info['photo_url'] = url_for('serve_photo', filename=user_info['photo_filename'], _external=True)
-        else:
-            user_info['photo_url'] = None
-        users_summary_with_photo_url.append(user_info)
-    
-    return jsonify(users=users_summary_with_photo_url), 200 
\ No newline at end of file
+    """管理员分页查看已注册用户列表 (ID, 姓名, 照片文件名, 照片及缩略图URL)，翻页时传入上一页返回的 next_cursor"""
+    default_limit = current_app.config.get('USER_LIST_PAGE_SIZE', 100)
+    max_limit = current_app.config.get('USER_LIST_MAX_PAGE_SIZE', 1000)
+    limit = request.args.get('limit', default=default_limit, type=int)
+    if limit is None or limit < 1 or limit > max_limit:
+        return jsonify(message=f"参数 limit 必须是 1 到 {max_limit} 之间的整数"), 400
+
+    try:
+        users, next_cursor = data_store.get_users_page(limit=limit, cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    return jsonify(users=[_add_photo_urls(user) for user in users], next_cursor=next_cursor), 200
@@ -0,0 +1,124 @@
+import json
+import time
+import threading
+
+# 签到去抖：同一用户在时间窗口内的重复签到直接返回已有记录，不再写数据库。
+# 最近签到缓存可以是进程内的 (默认)，也可以是多个进程/多台机器共享的 Redis。
+
+class MemoryBackend:
+    """进程内的最近签到缓存 (仅对当前进程有效)。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {} # user_id -> (过期时间, value)
+        self._next_prune = 0.0
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def claim(self, user_id, value, window):
+        """若用户在窗口内已签到，返回已有的 value；否则记录本次签到并返回 None (检查与写入是原子的)。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            self._entries[user_id] = (now + window, value)
+            if now >= self._next_prune: # 定期清理过期条目，避免字典无限增长
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                self._next_prune = now + window
+        return None
+
+    def release(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+class RedisBackend:
+    """基于 Redis 的共享最近签到缓存，多个 Web 进程共用同一个去抖窗口。需要安装 redis 包。"""
+
+    def __init__(self, url, prefix='signin:recent:'):
+        import redis # 可选依赖，只有启用该后端时才需要
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, user_id):
+        existing = self._client.get(self._prefix + user_id)
+        return json.loads(existing) if existing else None
+
+    def claim(self, user_id, value, window):
+        key = self._prefix + user_id
+        # SET NX PX: 仅在键不存在时写入，检查与写入在 Redis 端原子完成
+        if self._client.set(key, json.dumps(value), nx=True, px=int(window * 1000)):
+            return None
+        existing = self._client.get(key)
+        return json.loads(existing) if existing else None
+
+    def release(self, user_id):
+        self._client.delete(self._prefix + user_id)
+
+class SignInDebouncer:
+    """按用户去抖签到写入，window 为 0 时不去抖。"""
+
+    def __init__(self, window=0, backend=None):
+        self.window = window
+        self.backend = backend or MemoryBackend()
+        self._lock = threading.Lock()
+        self.suppressed = 0 # 被去抖跳过的写入次数 (当前进程)
+
+    def init_app(self, app):
+        self.window = app.config.get('SIGNIN_DEDUP_WINDOW_SECONDS', 0)
+        backend = app.config.get('SIGNIN_DEDUP_BACKEND', 'memory')
+        if backend == 'redis':
+            self.backend = RedisBackend(app.config['SIGNIN_DEDUP_REDIS_URL'])
+        elif backend == 'memory':
+            self.backend = MemoryBackend()
+        else:
+            raise ValueError(f"未知的签到去抖后端: {backend}")
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _suppress(self, user_id):
+        with self._lock:
+            self.suppressed += 1
+            suppressed = self.suppressed
+        print(f"用户ID {user_id} 在 {self.window} 秒内重复签到，已跳过写入 (累计跳过 {suppressed} 次)。")
+
+    def check(self, user_id):
+        """只读检查：返回窗口内已有的签到 {'name', 'timestamp'}，没有则返回 None。"""
+        if not self.enabled:
+            return None
+        existing = self.backend.get(user_id)
+        if existing is not None:
+            self._suppress(user_id)
+        return existing
+
+    def claim(self, user_id, name, timestamp):
+        """尝试为用户占用本次签到。
+
+        Returns:
+            None: 窗口内没有签到，调用方应写入签到记录 (写入失败时调用 release)。
+            dict: 窗口内已有的签到 {'name', 'timestamp'}，调用方应直接返回它而不写数据库。
+        """
+        if not self.enabled:
+            return None
+        value = {'name': name, 'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S")}
+        existing = self.backend.claim(user_id, value, self.window)
+        if existing is not None:
+            self._suppress(user_id)
+        return existing
+
+    def release(self, user_id):
+        if self.enabled:
+            self.backend.release(user_id)
+
+    def stats(self):
+        with self._lock:
+            return {'window_seconds': self.window, 'suppressed': self.suppressed}
+
+# 进程级单例，在 create_app 时按配置初始化
+signin_debouncer = SignInDebouncer()